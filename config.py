@@ -1,6 +1,13 @@
 from dynaconf import Dynaconf
 
-settings = Dynaconf(
-    envvar_prefix="HEOS_SCROBBLER",
-    settings_files=["settings.toml", ".secrets.toml"],
-)
+SETTINGS_FILES = ["settings.toml", ".secrets.toml"]
+
+
+def load_settings() -> Dynaconf:
+    return Dynaconf(
+        envvar_prefix="HEOS_SCROBBLER",
+        settings_files=SETTINGS_FILES,
+    )
+
+
+settings = load_settings()
@@ -0,0 +1,39 @@
+import time
+from datetime import UTC, datetime, timedelta
+from typing import Optional
+
+
+class TrackClock:
+    # Start times of tracks are kept as monotonic time so that wall clock adjustments, e.g. DST or NTP,
+    # between the start of a track and its scrobble don't shift them. They are converted to UTC only when scrobbled.
+    def __init__(self, max_lag_seconds: float):
+        self.max_lag_seconds: float = max_lag_seconds
+        self.started_at: Optional[float] = None
+        self.previous_started_at: Optional[float] = None
+        self._earliest_start: float = float("-inf")
+
+    def start(self, observed_at: float, position: Optional[int] = None, boundary_observed: bool = True) -> None:
+        self.previous_started_at = self.started_at
+        self.started_at = None
+        # Track started after the previous one, and an observed track change was handled at most max lag late,
+        # so e.g. seeking forward doesn't move the start minutes back. Missed track change can be much older.
+        self._earliest_start = max(
+            float("-inf") if self.previous_started_at is None else self.previous_started_at,
+            observed_at - self.max_lag_seconds if boundary_observed else float("-inf"),
+        )
+        self.progress(observed_at=observed_at, position=position or 0)
+
+    def progress(self, observed_at: float, position: Optional[int]) -> None:
+        if position is None:
+            return
+
+        # HEOS uses ms for position. Events handled late, e.g. behind a busy event loop, or after a pause
+        # only make the estimate later, so the earliest one is the most accurate.
+        started_at = max(observed_at - position / 1000, self._earliest_start)
+
+        if self.started_at is None or started_at < self.started_at:
+            self.started_at = started_at
+
+    @staticmethod
+    def to_datetime(monotonic_time: float) -> datetime:
+        return datetime.now(UTC) - timedelta(seconds=time.monotonic() - monotonic_time)
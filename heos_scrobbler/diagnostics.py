@@ -0,0 +1,197 @@
+import asyncio
+import collections
+import signal
+import sys
+import threading
+import tracemalloc
+from logging import Logger, getLogger
+from types import FrameType
+from typing import Final, Optional
+
+from config import settings
+
+_logger: Final[Logger] = getLogger(__name__)
+
+
+def count_tasks() -> collections.Counter[str]:
+    tasks: collections.Counter[str] = collections.Counter()
+
+    for task in asyncio.all_tasks():
+        coroutine = task.get_coro()
+        tasks[getattr(coroutine, "__qualname__", repr(coroutine))] += 1
+
+    return tasks
+
+
+def diff_memory_snapshots(
+    previous_snapshot: tracemalloc.Snapshot, snapshot: tracemalloc.Snapshot, top: int
+) -> list[tracemalloc.StatisticDiff]:
+    # Allocations of tracemalloc itself would dominate the diff
+    snapshot_filters = [tracemalloc.Filter(inclusive=False, filename_pattern=tracemalloc.__file__)]
+
+    return snapshot.filter_traces(snapshot_filters).compare_to(
+        previous_snapshot.filter_traces(snapshot_filters), "lineno"
+    )[:top]
+
+
+def sample_thread(
+    thread_id: int, sample_interval: float, stop_event: threading.Event
+) -> tuple[collections.Counter[str], collections.Counter[str], int]:
+    # Statistical profiler: cheap enough to run against a live event loop unlike cProfile
+    # which has to be enabled in the profiled thread and slows down every call
+    own_samples: collections.Counter[str] = collections.Counter()
+    total_samples: collections.Counter[str] = collections.Counter()
+    samples = 0
+
+    while not stop_event.wait(sample_interval):
+        frame: Optional[FrameType] = sys._current_frames().get(thread_id)
+
+        if frame is None:
+            break
+
+        samples += 1
+        own_samples[_describe_frame(frame)] += 1
+        # Recursive functions are counted once per sample
+        functions: set[str] = set()
+
+        while frame is not None:
+            functions.add(_describe_frame(frame))
+            frame = frame.f_back
+
+        total_samples.update(functions)
+
+    return own_samples, total_samples, samples
+
+
+async def measure_event_loop_lag(duration: float, interval: float) -> list[float]:
+    loop = asyncio.get_running_loop()
+    lags: list[float] = []
+    deadline = loop.time() + duration
+
+    while loop.time() < deadline:
+        started_at = loop.time()
+        await asyncio.sleep(interval)
+        lags.append(max(0.0, loop.time() - started_at - interval))
+
+    return lags
+
+
+class Diagnostics:
+    def __init__(self):
+        self._previous_snapshot: Optional[tracemalloc.Snapshot] = None
+        self._task: Optional[asyncio.Task[None]] = None
+
+    def trigger(self) -> None:
+        if self._task is not None and not self._task.done():
+            _logger.info("Diagnostics are already running")
+            return
+
+        self._task = asyncio.create_task(self.dump())
+
+    def stop_memory_tracing(self) -> None:
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+            _logger.info("Memory tracing stopped")
+
+        self._previous_snapshot = None
+
+    async def dump(self) -> None:
+        top = settings.diagnostics.top
+
+        try:
+            self._log_tasks(top)
+            self._log_memory(top)
+            await self._log_profile(top)
+        except Exception:
+            _logger.exception("Diagnostics failed")
+
+    def _log_tasks(self, top: int) -> None:
+        tasks = count_tasks()
+
+        _logger.info(
+            "%s asyncio tasks by coroutine:\n%s",
+            sum(tasks.values()),
+            "\n".join(f"{count:>6} {name}" for name, count in tasks.most_common(top)),
+        )
+
+    def _log_memory(self, top: int) -> None:
+        if not tracemalloc.is_tracing():
+            # Tracing slows down allocations so it is started only on demand, send SIGUSR2 to stop it
+            tracemalloc.start(settings.diagnostics.traceback_frames)
+            self._previous_snapshot = tracemalloc.take_snapshot()
+            _logger.info("Memory tracing started, memory diff is logged on next diagnostics")
+            return
+
+        snapshot = tracemalloc.take_snapshot()
+
+        if self._previous_snapshot is not None:
+            _logger.info(
+                "Top %s memory allocation changes since previous diagnostics:\n%s",
+                top,
+                "\n".join(
+                    str(statistic) for statistic in diff_memory_snapshots(self._previous_snapshot, snapshot, top)
+                ),
+            )
+
+        self._previous_snapshot = snapshot
+
+    async def _log_profile(self, top: int) -> None:
+        duration = settings.diagnostics.profile_seconds
+        stop_event = threading.Event()
+
+        _logger.info("Profiling event loop for %s seconds", duration)
+
+        # Sampler runs in its own thread, the event loop keeps running normally while being sampled
+        sampling = asyncio.create_task(
+            asyncio.to_thread(
+                sample_thread, threading.get_ident(), settings.diagnostics.sample_interval_seconds, stop_event
+            )
+        )
+
+        try:
+            lags = await measure_event_loop_lag(duration, interval=settings.diagnostics.lag_interval_seconds)
+        finally:
+            stop_event.set()
+
+        own_samples, total_samples, samples = await sampling
+
+        if lags:
+            lags.sort()
+            _logger.info(
+                "Event loop lag in ms: mean %.2f, p99 %.2f, max %.2f",
+                sum(lags) / len(lags) * 1000,
+                lags[int(len(lags) * 0.99)] * 1000,
+                lags[-1] * 1000,
+            )
+
+        if samples:
+            _logger.info(
+                "Event loop CPU profile, %s samples, own %% / total %%:\n%s",
+                samples,
+                "\n".join(
+                    f"{own_samples[function] / samples:>7.1%} {total_samples[function] / samples:>7.1%} {function}"
+                    # Frames of the event loop itself are in every sample, so own time tells more
+                    for function in sorted(
+                        total_samples,
+                        key=lambda function: (own_samples[function], total_samples[function]),
+                        reverse=True,
+                    )[:top]
+                ),
+            )
+
+
+def add_diagnostics_signal_handlers() -> None:
+    # SIGUSR1 and SIGUSR2 are not available on Windows
+    if sys.platform == "win32" or not settings.diagnostics.enabled:
+        return
+
+    loop = asyncio.get_running_loop()
+    diagnostics = Diagnostics()
+
+    # Nothing runs before the first signal, so diagnostics have no overhead when not used
+    loop.add_signal_handler(signal.SIGUSR1, diagnostics.trigger)
+    loop.add_signal_handler(signal.SIGUSR2, diagnostics.stop_memory_tracing)
+
+
+def _describe_frame(frame: FrameType) -> str:
+    return f"{frame.f_code.co_qualname} ({frame.f_code.co_filename}:{frame.f_code.co_firstlineno})"
@@ -0,0 +1,151 @@
+import asyncio
+import collections
+import os
+import re
+from logging import Logger, getLogger
+from typing import Any, Final, Iterable, Optional
+
+from pyheos import HeosNowPlayingMedia
+
+from config import SETTINGS_FILES, load_settings, settings
+
+_logger: Final[Logger] = getLogger(__name__)
+
+# Fields of HeosNowPlayingMedia which rules can match with regular expressions
+_PATTERN_FIELDS: Final[tuple[str, ...]] = ("artist", "album", "song", "station")
+# Unescaped \1 to \99, (?P=name) and (?(group)...), they would refer to wrong groups once patterns are combined
+_BACKREFERENCE: Final[re.Pattern[str]] = re.compile(r"(?<!\\)(?:\\\\)*(?:\\[1-9]|\(\?P=|\(\?\()")
+
+
+class CompiledScrobbleFilter:
+    # Track is excluded when any condition of any rule matches. All rules are evaluated in a single pass:
+    # sources and players are hash lookups and patterns of each field are combined into one regular expression.
+    def __init__(self, rules: Iterable[dict[str, Any]]):
+        self.rule_names: list[str] = []
+        self._rules_by_source_id: dict[int, str] = {}
+        self._rules_by_player_name: dict[str, str] = {}
+        self._patterns: dict[str, Optional[re.Pattern[str]]] = {}
+        self._rule_names_by_group: dict[str, str] = {}
+        patterns: dict[str, list[str]] = {field: [] for field in _PATTERN_FIELDS}
+
+        for index, rule in enumerate(rules):
+            name = str(rule.get("name", f"rule {index}"))
+            self.rule_names.append(name)
+
+            for source_id in rule.get("source_ids", []):
+                self._rules_by_source_id.setdefault(int(source_id), name)
+
+            for player_name in rule.get("players", []):
+                self._rules_by_player_name.setdefault(str(player_name).casefold(), name)
+
+            for field in _PATTERN_FIELDS:
+                if field not in rule:
+                    continue
+
+                try:
+                    re.compile(rule[field])
+                except re.error as exc:
+                    raise ValueError(f"Invalid {field} pattern in scrobble filter rule {name}: {exc}") from exc
+
+                if _BACKREFERENCE.search(rule[field]):
+                    raise ValueError(
+                        f"Backreferences are not supported in {field} pattern of scrobble filter rule {name}"
+                    )
+
+                group = f"rule_{index}"
+                patterns[field].append(f"(?P<{group}>{rule[field]})")
+                self._rule_names_by_group[group] = name
+
+        for field, field_patterns in patterns.items():
+            try:
+                self._patterns[field] = re.compile("|".join(field_patterns), re.IGNORECASE) if field_patterns else None
+            except re.error as exc:
+                # E.g. inline global flags are only allowed at the start of the whole expression
+                raise ValueError(f"Invalid {field} patterns in scrobble filter rules: {exc}") from exc
+
+    def match(self, heos_track: HeosNowPlayingMedia, player_name: Optional[str]) -> Optional[str]:
+        if heos_track.source_id is not None and heos_track.source_id in self._rules_by_source_id:
+            return self._rules_by_source_id[heos_track.source_id]
+
+        if player_name is not None and player_name.casefold() in self._rules_by_player_name:
+            return self._rules_by_player_name[player_name.casefold()]
+
+        for field, pattern in self._patterns.items():
+            value = getattr(heos_track, field)
+
+            if pattern is not None and value and (match := pattern.search(value)) is not None:
+                return self._rule_names_by_group[str(match.lastgroup)]
+
+        return None
+
+
+class ScrobbleFilter:
+    def __init__(self):
+        self.match_counts: collections.Counter[str] = collections.Counter()
+        self._compiled_filter: CompiledScrobbleFilter = CompiledScrobbleFilter(settings.filters.rules)
+        self._settings_modified_at: dict[str, float] = self._get_settings_modified_at()
+        self._task: Optional[asyncio.Task[None]] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._watch())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+            self._task = None
+
+    def match(self, heos_track: HeosNowPlayingMedia, player_name: Optional[str]) -> Optional[str]:
+        return self._compiled_filter.match(heos_track, player_name)
+
+    def exclude(self, heos_track: HeosNowPlayingMedia, player_name: Optional[str]) -> bool:
+        rule_name = self.match(heos_track, player_name)
+
+        if rule_name is None:
+            return False
+
+        self.match_counts[rule_name] += 1
+        _logger.info(
+            "Track %s/%s: %s excluded from scrobbling by rule %s (%s matches)",
+            heos_track.artist,
+            heos_track.album,
+            heos_track.song,
+            rule_name,
+            self.match_counts[rule_name],
+        )
+
+        return True
+
+    def reload(self) -> None:
+        try:
+            # Only rules are reloaded, other settings keep the values the process was started with
+            compiled_filter = CompiledScrobbleFilter(load_settings().filters.rules)
+        except Exception:
+            _logger.exception("Failed to reload scrobble filter rules, keeping previous rules")
+            return
+
+        self._compiled_filter = compiled_filter
+        # Counters of removed rules are dropped
+        self.match_counts = collections.Counter(
+            {name: count for name, count in self.match_counts.items() if name in compiled_filter.rule_names}
+        )
+        _logger.info("Reloaded scrobble filter rules: %s", compiled_filter.rule_names)
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(settings.filters.reload_interval_seconds)
+
+            settings_modified_at = self._get_settings_modified_at()
+
+            if settings_modified_at != self._settings_modified_at:
+                self._settings_modified_at = settings_modified_at
+                self.reload()
+
+    @staticmethod
+    def _get_settings_modified_at() -> dict[str, float]:
+        return {path: os.stat(path).st_mtime for path in SETTINGS_FILES if os.path.exists(path)}
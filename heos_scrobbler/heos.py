@@ -1,22 +1,30 @@
 import asyncio
+import contextlib
 import dataclasses
 import pprint
 import socket
 import sys
+import time
 from datetime import datetime
 from logging import Logger, getLogger
-from typing import Any, Callable, Coroutine, Final, Union
+from typing import Any, Callable, Coroutine, Final, Optional, Union
 
 from pydantic import ValidationError
-from pyheos import Heos, HeosNowPlayingMedia, HeosPlayer, MediaType
+from pyheos import ConnectionState, Heos, HeosError, HeosNowPlayingMedia, HeosPlayer, MediaType, PlayState
 from pyheos import const as HeosConstants
 from ssdp import network
 from ssdp.aio import SSDP
 from ssdp.messages import SSDPRequest, SSDPResponse
 
 from config import settings
-from heos_scrobbler.last_fm import LastFmScrobbler, LastFmScrobblerRetryableScrobbleException
-from heos_scrobbler.util import State, retry
+from heos_scrobbler.clock import TrackClock
+from heos_scrobbler.filters import ScrobbleFilter
+from heos_scrobbler.history import ListeningHistory, Play, ScrobbleStatus
+from heos_scrobbler.idempotency import ScrobbleIndex
+from heos_scrobbler.last_fm import LastFmScrobbler, LibreFmScrobbler
+from heos_scrobbler.listenbrainz import ListenBrainzScrobbler
+from heos_scrobbler.scrobbling import ScrobblingBackend, ScrobblingBackendQueue, ScrobblingBackends
+from heos_scrobbler.util import State
 
 _logger: Final[Logger] = getLogger(__name__)
 
@@ -40,50 +48,206 @@ class HeosDeviceDiscoveryProtocol(SSDP):  # pragma: no cover
 
 
 class HeosScrobbler:
-    def __init__(self, last_fm_scrobbler: LastFmScrobbler):
-        self.last_fm_scrobbler: LastFmScrobbler = last_fm_scrobbler
+    def __init__(
+        self,
+        scrobbling_backends: ScrobblingBackends,
+        listening_history: Optional[ListeningHistory] = None,
+        heos_player: Optional[HeosPlayer] = None,
+        scrobble_filter: Optional[ScrobbleFilter] = None,
+    ):
+        self.scrobbling_backends: ScrobblingBackends = scrobbling_backends
+        self.listening_history: Optional[ListeningHistory] = listening_history
+        self.heos_player: Optional[HeosPlayer] = heos_player
+        self.scrobble_filter: Optional[ScrobbleFilter] = scrobble_filter
         self.heos_track_for_scrobbling: State = State(HeosNowPlayingMedia())
         self.heos_track_for_now_playing: State = State(HeosNowPlayingMedia())
+        self.track_clock: TrackClock = TrackClock(max_lag_seconds=settings.max_event_lag_seconds)
+        self._pending_scrobbles: set[asyncio.Future[None]] = set()
+        self._now_playing_task: Optional[asyncio.Task[None]] = None
 
-    async def scrobble(self, heos_track: HeosNowPlayingMedia, scrobbled_at: datetime) -> None:
-        self.heos_track_for_scrobbling.update(heos_track)
+    async def scrobble(self, heos_track: HeosNowPlayingMedia, observed_at: Optional[float] = None) -> None:
+        task = self._start_scrobble(
+            heos_track=heos_track, observed_at=time.monotonic() if observed_at is None else observed_at
+        )
 
-        if self.heos_track_for_scrobbling.previous_value is not None:
-            await self._scrobble(
-                heos_track=dataclasses.replace(self.heos_track_for_scrobbling.previous_value), scrobbled_at=scrobbled_at
-            )
+        if task is not None:
+            # Shield the scrobble so that cancelling the event callback does not lose it,
+            # pending scrobbles are flushed or cancelled explicitly on shutdown
+            await asyncio.shield(task)
+
+    def resync(self, heos_track: HeosNowPlayingMedia) -> None:
+        # NOW_PLAYING_CHANGED event may have been missed while the connection was down.
+        # Refreshed media has no position nor duration, so progress and now playing of the current track
+        # are reconciled by the next progress event.
+        if self.heos_track_for_scrobbling.value.media_id != heos_track.media_id:
+            _logger.info("Track changed while HEOS events were not received, reconciling scrobbling state")
+            # Don't wait for the scrobble to complete so that the caller is not blocked by retries
+            self._start_scrobble(heos_track=heos_track, observed_at=time.monotonic(), boundary_observed=False)
+
+    async def flush(self, timeout: float) -> None:
+        # Now playing is pointless once the process is shutting down
+        self._cancel_now_playing()
+
+        if not self._pending_scrobbles:
+            return
+
+        _logger.info("Waiting %s seconds for %s pending scrobbles", timeout, len(self._pending_scrobbles))
+
+        _, pending = await asyncio.wait(set(self._pending_scrobbles), timeout=timeout)
+
+        for task in pending:
+            task.cancel()
+
+        if pending:
+            _logger.warning("%s pending scrobbles could not be submitted before shutdown", len(pending))
 
     def update_now_playing(self, heos_track: HeosNowPlayingMedia) -> None:
         if self.heos_track_for_now_playing.value.media_id != heos_track.media_id and heos_track.duration:
             self.heos_track_for_now_playing.update(heos_track)
-            self._update_now_playing(heos_track=dataclasses.replace(self.heos_track_for_now_playing.value))
+            self._cancel_now_playing()
+            self._now_playing_task = asyncio.create_task(
+                self._keep_now_playing_updated(heos_track=dataclasses.replace(self.heos_track_for_now_playing.value))
+            )
+
+    def handle_play_state(self, state: Optional[PlayState]) -> None:
+        # Now playing is not kept updated while paused or stopped,
+        # it is sent again by the next progress event once playback resumes
+        if state != PlayState.PLAY:
+            self._cancel_now_playing()
+            self.heos_track_for_now_playing.update(HeosNowPlayingMedia())
 
-    def handle_progress_for_track_to_be_scrobbled(self, heos_track: HeosNowPlayingMedia) -> None:
+    def handle_progress_for_track_to_be_scrobbled(
+        self, heos_track: HeosNowPlayingMedia, observed_at: Optional[float] = None
+    ) -> None:
         if (
             self.heos_track_for_scrobbling.value.media_id is None
             or self.heos_track_for_scrobbling.value.media_id == heos_track.media_id
         ) and heos_track.current_position:
             self.heos_track_for_scrobbling.update(heos_track)
+            self.track_clock.progress(
+                observed_at=time.monotonic() if observed_at is None else observed_at,
+                position=heos_track.current_position,
+            )
 
-    @retry(max_delay=settings.retry_scrobble_for_hours * 60 * 60, retry_on=LastFmScrobblerRetryableScrobbleException)
-    async def _scrobble(self, heos_track: HeosNowPlayingMedia, scrobbled_at: datetime) -> None:
-        if self.can_scrobble_track(heos_track=heos_track):
-            try:
-                await self.last_fm_scrobbler.scrobble(
-                    artist=heos_track.artist or "",
-                    track=heos_track.song or "",
-                    scrobbled_at=scrobbled_at,
-                    album=heos_track.album or "",
-                )
-            except ValidationError:
-                _logger.info(
-                    "Track %s/%s: %s not suitable for scrobbling", heos_track.artist, heos_track.album, heos_track.song
+    def _start_scrobble(
+        self, heos_track: HeosNowPlayingMedia, observed_at: float, boundary_observed: bool = True
+    ) -> Optional[asyncio.Future[None]]:
+        # Skipped track must not show up as now playing once the settle delay passes
+        if self.heos_track_for_now_playing.value.media_id != heos_track.media_id:
+            self._cancel_now_playing()
+
+        self.heos_track_for_scrobbling.update(heos_track)
+        # Media of a track change has no position, start of the track is refined by its progress events
+        self.track_clock.start(
+            observed_at=observed_at, position=heos_track.current_position, boundary_observed=boundary_observed
+        )
+
+        if self.heos_track_for_scrobbling.previous_value is None:
+            return None
+
+        task = asyncio.ensure_future(
+            self._scrobble_and_record(
+                heos_track=dataclasses.replace(self.heos_track_for_scrobbling.previous_value),
+                # Without progress events the start of the previous track is unknown, it ended at the latest now
+                started_at=observed_at
+                if self.track_clock.previous_started_at is None
+                else self.track_clock.previous_started_at,
+            )
+        )
+        self._pending_scrobbles.add(task)
+        task.add_done_callback(self._pending_scrobbles.discard)
+
+        return task
+
+    async def _scrobble_and_record(self, heos_track: HeosNowPlayingMedia, started_at: float) -> None:
+        # Scrobble timestamp is the start of the track, converted once so that retries and all backends share it
+        scrobbled_at = TrackClock.to_datetime(started_at)
+        submission = self._scrobble(heos_track=heos_track, scrobbled_at=scrobbled_at)
+
+        # Play is recorded when it happens, outcomes of scrobbling backends are recorded by them once known.
+        # Tracks without metadata are not worth keeping in history.
+        if self.listening_history is not None and heos_track.artist and heos_track.song:
+            self.listening_history.record(
+                Play(
+                    played_at=scrobbled_at,
+                    player_id=self.heos_player.player_id if self.heos_player else None,
+                    player_name=self.heos_player.name if self.heos_player else None,
+                    artist=heos_track.artist,
+                    track=heos_track.song,
+                    album=heos_track.album,
+                    duration=heos_track.duration,
+                    position=heos_track.current_position,
+                    status=ScrobbleStatus.SKIPPED if submission is None else ScrobbleStatus.SUBMITTED,
                 )
+            )
+
+        if submission is not None:
+            # Scrobbling backends log their failures
+            with contextlib.suppress(Exception):
+                await submission
+
+    def _scrobble(self, heos_track: HeosNowPlayingMedia, scrobbled_at: datetime) -> Optional[asyncio.Future[None]]:
+        if not self.can_scrobble_track(heos_track=heos_track):
+            return None
+
+        if self.scrobble_filter is not None and self.scrobble_filter.exclude(
+            heos_track, player_name=self.heos_player.name if self.heos_player else None
+        ):
+            return None
+
+        try:
+            # Each scrobbling backend retries failed scrobbles by itself
+            return self.scrobbling_backends.scrobble(
+                artist=heos_track.artist or "",
+                track=heos_track.song or "",
+                scrobbled_at=scrobbled_at,
+                album=heos_track.album or "",
+                player_id=self.heos_player.player_id if self.heos_player else None,
+                player_name=self.heos_player.name if self.heos_player else None,
+            )
+        except ValidationError:
+            _logger.info(
+                "Track %s/%s: %s not suitable for scrobbling", heos_track.artist, heos_track.album, heos_track.song
+            )
+            return None
+
+    def _cancel_now_playing(self) -> None:
+        if self._now_playing_task is not None:
+            self._now_playing_task.cancel()
+            self._now_playing_task = None
+
+    async def _keep_now_playing_updated(self, heos_track: HeosNowPlayingMedia) -> None:
+        # Task is cancelled if track changes during the settle delay, e.g. when skipping through a playlist
+        await asyncio.sleep(settings.now_playing.settle_delay_seconds)
+        self._update_now_playing(heos_track=heos_track)
+
+        # Last.fm expires now playing before long tracks end so it must be refreshed
+        refresh_interval = settings.now_playing.refresh_interval_seconds
+        # HEOS uses ms for duration and position
+        remaining = (
+            (heos_track.duration or 0) - (heos_track.current_position or 0)
+        ) / 1000 - settings.now_playing.settle_delay_seconds
+
+        while refresh_interval > 0 and remaining > refresh_interval:
+            await asyncio.sleep(refresh_interval)
+            remaining -= refresh_interval
+
+            # Refreshing must not bring back a track which is no longer playing
+            if (
+                self.heos_player is not None and self.heos_player.state != PlayState.PLAY
+            ) or self.heos_track_for_now_playing.value.media_id != heos_track.media_id:
+                return
+
+            self._update_now_playing(heos_track=heos_track)
 
     def _update_now_playing(self, heos_track: HeosNowPlayingMedia) -> None:
-        if HeosScrobbler.cap_update_now_playing(heos_track=heos_track):
+        if HeosScrobbler.cap_update_now_playing(heos_track=heos_track) and (
+            self.scrobble_filter is None
+            or self.scrobble_filter.match(heos_track, player_name=self.heos_player.name if self.heos_player else None)
+            is None
+        ):
             try:
-                self.last_fm_scrobbler.update_now_playing(
+                self.scrobbling_backends.update_now_playing(
                     artist=heos_track.artist or "",
                     track=heos_track.song or "",
                     # HEOS uses ms for duration, Last.fm seconds
@@ -108,6 +272,181 @@ class HeosScrobbler:
         )
 
 
+class HeosConnectionWatchdog:
+    def __init__(self, heos: Heos, heos_player: HeosPlayer, heos_scrobbler: HeosScrobbler):
+        self.heos: Heos = heos
+        self.heos_player: HeosPlayer = heos_player
+        self.heos_scrobbler: HeosScrobbler = heos_scrobbler
+        # Monotonic time is used so that wall clock adjustments don't trigger false stalls
+        self._last_event_at: float = time.monotonic()
+        self._last_alive_at: float = time.monotonic()
+        # Some sources, e.g. AUX input, don't send progress events at all
+        self._progress_received: bool = False
+        self._task: Optional[asyncio.Task[None]] = None
+        self._remove_callbacks: list[Callable[[], None]] = []
+
+    def start(self) -> None:
+        self._remove_callbacks = [
+            self.heos_player.add_on_player_event(self.on_player_event),
+            self.heos.add_on_connected(self.on_connected),
+        ]
+        self._task = asyncio.create_task(self._watch())
+
+    async def stop(self) -> None:
+        for remove_callback in self._remove_callbacks:
+            remove_callback()
+
+        self._remove_callbacks = []
+
+        if self._task is not None:
+            self._task.cancel()
+
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+            self._task = None
+
+    async def on_player_event(self, heos_event: str) -> None:
+        self._last_event_at = self._last_alive_at = time.monotonic()
+
+        if heos_event == HeosConstants.EVENT_PLAYER_NOW_PLAYING_PROGRESS:
+            self._progress_received = True
+        elif heos_event == HeosConstants.EVENT_PLAYER_NOW_PLAYING_CHANGED:
+            self._progress_received = False
+
+    async def on_connected(self) -> None:
+        _logger.info("Connected to HEOS device with IP %s, resyncing now playing state", self.heos_player.ip_address)
+        self._last_event_at = self._last_alive_at = time.monotonic()
+        # Track may have changed while disconnected
+        self._progress_received = False
+
+        try:
+            await self.heos_player.refresh_now_playing_media()
+        except HeosError:
+            _logger.warning("Failed to refresh now playing media of HEOS player with id %s", self.heos_player.player_id)
+            return
+
+        self.heos_scrobbler.resync(dataclasses.replace(self.heos_player.now_playing_media))
+
+    async def check(self) -> None:
+        # pyheos is already reconnecting
+        if self.heos.connection_state == ConnectionState.RECONNECTING:
+            return
+
+        if self.heos.connection_state == ConnectionState.DISCONNECTED:
+            await self._reconnect()
+            return
+
+        now = time.monotonic()
+
+        # Progress events are sent constantly while playing sources which send them at all,
+        # silence means that the connection is stalled
+        if (
+            self.heos_player.state == PlayState.PLAY
+            and self._progress_received
+            and now - self._last_event_at >= settings.heos.watchdog.progress_timeout_seconds
+        ):
+            _logger.warning(
+                "No events from HEOS device with IP %s for %s seconds while playing, reconnecting",
+                self.heos_player.ip_address,
+                round(now - self._last_event_at),
+            )
+            await self._reconnect()
+        elif now - self._last_alive_at >= settings.heos.watchdog.heart_beat_interval_seconds:
+            try:
+                await asyncio.wait_for(
+                    self.heos.heart_beat(), timeout=settings.heos.watchdog.heart_beat_timeout_seconds
+                )
+                self._last_alive_at = time.monotonic()
+            except (HeosError, TimeoutError):
+                _logger.warning(
+                    "Heart beat to HEOS device with IP %s failed, reconnecting", self.heos_player.ip_address
+                )
+                await self._reconnect()
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(settings.heos.watchdog.check_interval_seconds)
+
+            try:
+                await self.check()
+            except Exception:
+                _logger.exception("HEOS connection watchdog check failed")
+
+    async def _reconnect(self) -> None:
+        try:
+            await self.heos.disconnect()
+            # Now playing state is resynced by on_connected callback
+            await self.heos.connect()
+        except HeosError:
+            _logger.warning(
+                "Failed to reconnect to HEOS device with IP %s, retrying in %s seconds",
+                self.heos_player.ip_address,
+                settings.heos.watchdog.check_interval_seconds,
+            )
+
+
+@dataclasses.dataclass
+class HeosConnection:
+    heos: Heos
+    heos_scrobbler: Optional[HeosScrobbler] = None
+    remove_player_event_callback: Optional[Callable[[], None]] = None
+    watchdog: Optional[HeosConnectionWatchdog] = None
+
+
+@dataclasses.dataclass
+class HeosScrobbling:
+    heos_connections: list[HeosConnection]
+    scrobbling_backends: ScrobblingBackends
+    listening_history: Optional[ListeningHistory] = None
+    scrobble_filter: Optional[ScrobbleFilter] = None
+    # Devices which could not be connected to are retried in the background
+    connect_tasks: list[asyncio.Task[None]] = dataclasses.field(default_factory=list)
+
+
+def create_scrobbling_backends(listening_history: Optional[ListeningHistory] = None) -> ScrobblingBackends:
+    backends: dict[str, Callable[[], ScrobblingBackend]] = {
+        "last_fm": LastFmScrobbler,
+        "libre_fm": LibreFmScrobbler,
+        "listenbrainz": lambda: ListenBrainzScrobbler(
+            url=settings.backends.listenbrainz.url, token=settings.listenbrainz.token
+        ),
+    }
+    queues: list[ScrobblingBackendQueue] = []
+    scrobble_index: Optional[ScrobbleIndex] = None
+
+    if settings.idempotency.enabled:
+        scrobble_index = ScrobbleIndex(path=settings.idempotency.path, capacity=settings.idempotency.capacity)
+        scrobble_index.open()
+
+    for name, create_backend in backends.items():
+        backend_settings = settings.backends[name]
+
+        if not backend_settings.enabled:
+            continue
+
+        queues.append(
+            ScrobblingBackendQueue(
+                name=name,
+                backend=create_backend(),
+                batch_size=backend_settings.batch_size,
+                min_request_interval=backend_settings.min_request_interval_seconds,
+                retry_scrobble_for_hours=backend_settings.get(
+                    "retry_scrobble_for_hours", settings.retry_scrobble_for_hours
+                ),
+                scrobble_index=scrobble_index,
+            )
+        )
+        _logger.info("Scrobbling to %s", name)
+
+    if not queues:
+        _logger.warning("All scrobbling backends are disabled, plays are only recorded to listening history")
+
+    return ScrobblingBackends(queues=queues, scrobble_index=scrobble_index, listening_history=listening_history)
+
+
 async def _discover_heos_devices() -> list[str]:  # pragma: no cover
     loop = asyncio.get_event_loop()
 
@@ -144,57 +483,183 @@ def _create_on_heos_player_event_callback(
     heos_player: HeosPlayer, heos_scrobbler: HeosScrobbler
 ) -> Callable[[str], Coroutine[Any, Any, None]]:
     async def callback(heos_event: str) -> None:
+        # Taken before anything else so that the time is as close to the event as possible
+        observed_at = time.monotonic()
         _logger.debug("Received HEOS event: %s", heos_event)
         heos_track = heos_player.now_playing_media
         _logger.debug("Current HEOS track: %s", pprint.pformat(heos_track))
 
         if heos_event == HeosConstants.EVENT_PLAYER_NOW_PLAYING_CHANGED:
-            await heos_scrobbler.scrobble(heos_track=heos_track, scrobbled_at=datetime.now())
+            await heos_scrobbler.scrobble(heos_track=heos_track, observed_at=observed_at)
         elif heos_event == HeosConstants.EVENT_PLAYER_NOW_PLAYING_PROGRESS:
             # After EVENT_PLAYER_NOW_PLAYING_CHANGED track duration is 0
             # We need to update duration here for the next track to be scrobbled
             # so that we can ensure it's been listened enough
-            heos_scrobbler.handle_progress_for_track_to_be_scrobbled(heos_track)
+            heos_scrobbler.handle_progress_for_track_to_be_scrobbled(heos_track, observed_at=observed_at)
             # We need to update now playing here to get proper duration down the line
             heos_scrobbler.update_now_playing(heos_track)
+        elif heos_event == HeosConstants.EVENT_PLAYER_STATE_CHANGED:
+            heos_scrobbler.handle_play_state(heos_player.state)
 
     return callback
 
 
-async def initialize_heos_scrobbling() -> None:
-    _logger.info("Discovering HEOS devices, waiting responses for %s seconds...", settings.heos.ssdp.mx)
+async def _connect_heos_device(heos_scrobbling: HeosScrobbling, heos_device_ip: str) -> HeosConnection:
+    heos = await Heos.create_and_connect(heos_device_ip, auto_reconnect=settings.heos.auto_reconnect)
+    heos_connection = HeosConnection(heos=heos)
+
+    try:
+        heos_players = await heos.get_players()
+    except BaseException:
+        await heos.disconnect()
+        raise
+
+    _logger.info("HEOS device with IP %s has players\n%s", heos_device_ip, pprint.pformat(heos_players))
+
+    try:
+        # Since we connect to each HEOS device directly we are only interested in events of that device
+        heos_player = next(
+            heos_player for heos_player in heos_players.values() if heos_player.ip_address == heos_device_ip
+        )
+        scrobbler = HeosScrobbler(
+            scrobbling_backends=heos_scrobbling.scrobbling_backends,
+            listening_history=heos_scrobbling.listening_history,
+            heos_player=heos_player,
+            scrobble_filter=heos_scrobbling.scrobble_filter,
+        )
+
+        heos_connection.heos_scrobbler = scrobbler
+        heos_connection.remove_player_event_callback = heos_player.add_on_player_event(
+            _create_on_heos_player_event_callback(heos_player=heos_player, heos_scrobbler=scrobbler)
+        )
+
+        if settings.heos.watchdog.enabled:
+            heos_connection.watchdog = HeosConnectionWatchdog(
+                heos=heos, heos_player=heos_player, heos_scrobbler=scrobbler
+            )
+            heos_connection.watchdog.start()
+
+        _logger.info(
+            "Listening player events of HEOS player with id %s and IP %s", heos_player.player_id, heos_device_ip
+        )
+    except StopIteration:
+        _logger.info("HEOS device with IP %s does not have player for itself", heos_device_ip)
+
+    return heos_connection
+
+
+async def _keep_connecting_heos_device(heos_scrobbling: HeosScrobbling, heos_device_ip: str) -> None:
+    while True:
+        await asyncio.sleep(settings.heos.connect_retry_interval_seconds)
+
+        try:
+            heos_scrobbling.heos_connections.append(await _connect_heos_device(heos_scrobbling, heos_device_ip))
+            _logger.info("Connected to HEOS device with IP %s", heos_device_ip)
+            return
+        except HeosError:
+            _logger.warning(
+                "Failed to connect to HEOS device with IP %s, retrying in %s seconds",
+                heos_device_ip,
+                settings.heos.connect_retry_interval_seconds,
+            )
+
+
+async def initialize_heos_scrobbling(
+    heos_device_ips: Optional[list[str]] = None, scrobbling_backends: Optional[ScrobblingBackends] = None
+) -> HeosScrobbling:
+    if heos_device_ips is None:
+        _logger.info("Discovering HEOS devices, waiting responses for %s seconds...", settings.heos.ssdp.mx)
+
+        heos_device_ips = await _discover_heos_devices()
 
-    heos_device_ips = await _discover_heos_devices()
+        if len(heos_device_ips) == 0:
+            _logger.warning("No HEOS devices found!")
+            exit(1)
 
-    if len(heos_device_ips) == 0:
-        _logger.warning("No HEOS devices found!")
-        exit(1)
+        _logger.info("Found HEOS devices with following IP addresses:\n%s", heos_device_ips)
 
-    _logger.info("Found HEOS devices with following IP addresses:\n%s", heos_device_ips)
+    listening_history: Optional[ListeningHistory] = None
 
-    last_fm_scrobbler = LastFmScrobbler()
+    if settings.history.enabled:
+        listening_history = ListeningHistory(path=settings.history.path, batch_size=settings.history.batch_size)
+        listening_history.start()
+
+    if scrobbling_backends is None:
+        scrobbling_backends = create_scrobbling_backends(listening_history=listening_history)
+
+    scrobbling_backends.start()
+
+    scrobble_filter = ScrobbleFilter()
+    scrobble_filter.start()
+
+    heos_scrobbling = HeosScrobbling(
+        heos_connections=[],
+        scrobbling_backends=scrobbling_backends,
+        listening_history=listening_history,
+        scrobble_filter=scrobble_filter,
+    )
 
     # One HEOS device can be used to control all HEOS devices in the same network
     # Let's still connect to each device directly for reliability
     for heos_device_ip in heos_device_ips:
-        heos = await Heos.create_and_connect(heos_device_ip, auto_reconnect=settings.heos.auto_reconnect)
+        try:
+            heos_scrobbling.heos_connections.append(await _connect_heos_device(heos_scrobbling, heos_device_ip))
+        except HeosError:
+            # Unreachable device must not prevent scrobbling of the others
+            _logger.warning(
+                "Failed to connect to HEOS device with IP %s, retrying in %s seconds",
+                heos_device_ip,
+                settings.heos.connect_retry_interval_seconds,
+            )
+            heos_scrobbling.connect_tasks.append(
+                asyncio.create_task(_keep_connecting_heos_device(heos_scrobbling, heos_device_ip))
+            )
 
-        heos_players = await heos.get_players()
-        _logger.info("HEOS device with IP %s has players\n%s", heos_device_ip, pprint.pformat(heos_players))
+    return heos_scrobbling
+
+
+async def shutdown_heos_scrobbling(heos_scrobbling: HeosScrobbling, timeout: float) -> None:
+    _logger.info("Shutting down HEOS scrobbling")
+
+    for connect_task in heos_scrobbling.connect_tasks:
+        connect_task.cancel()
+
+    await asyncio.gather(*heos_scrobbling.connect_tasks, return_exceptions=True)
+
+    heos_connections = heos_scrobbling.heos_connections
+
+    # Watchdogs must not reconnect connections that are being closed
+    for heos_connection in heos_connections:
+        if heos_connection.watchdog is not None:
+            await heos_connection.watchdog.stop()
+
+    # Stop accepting new player events first so that no new scrobbles are started while flushing
+    for heos_connection in heos_connections:
+        if heos_connection.remove_player_event_callback is not None:
+            heos_connection.remove_player_event_callback()
+            heos_connection.remove_player_event_callback = None
 
+    # All scrobblers share the same deadline
+    await asyncio.gather(
+        *[
+            heos_connection.heos_scrobbler.flush(timeout=timeout)
+            for heos_connection in heos_connections
+            if heos_connection.heos_scrobbler is not None
+        ]
+    )
+
+    # Scrobbles still queued after the deadline are cancelled
+    await heos_scrobbling.scrobbling_backends.close()
+
+    for heos_connection in heos_connections:
         try:
-            # Since we connect to each HEOS device directly we are only interested in events of that device
-            heos_player = next(
-                heos_player for heos_player in heos_players.values() if heos_player.ip_address == heos_device_ip
-            )
-            scrobbler = HeosScrobbler(last_fm_scrobbler=last_fm_scrobbler)
+            await heos_connection.heos.disconnect()
+        except Exception:
+            _logger.exception("Failed to disconnect HEOS connection")
 
-            heos_player.add_on_player_event(
-                _create_on_heos_player_event_callback(heos_player=heos_player, heos_scrobbler=scrobbler)
-            )
+    if heos_scrobbling.scrobble_filter is not None:
+        await heos_scrobbling.scrobble_filter.stop()
 
-            _logger.info(
-                "Listening player events of HEOS player with id %s and IP %s", heos_player.player_id, heos_device_ip
-            )
-        except StopIteration:
-            _logger.info("HEOS device with IP %s does not have player for itself", heos_device_ip)
+    # Flushed and cancelled scrobbles have been recorded by now
+    if heos_scrobbling.listening_history is not None:
+        await heos_scrobbling.listening_history.close()
@@ -0,0 +1,350 @@
+import asyncio
+import collections
+import dataclasses
+import sqlite3
+from datetime import date, datetime
+from enum import StrEnum
+from logging import Logger, getLogger
+from pathlib import Path
+from typing import Final, Optional, Union
+
+_logger: Final[Logger] = getLogger(__name__)
+
+_SCHEMA: Final[str] = """
+CREATE TABLE IF NOT EXISTS plays (
+    id INTEGER PRIMARY KEY,
+    played_at INTEGER NOT NULL,
+    player_id INTEGER,
+    player_name TEXT,
+    artist TEXT NOT NULL,
+    track TEXT NOT NULL,
+    album TEXT,
+    duration INTEGER,
+    position INTEGER,
+    status TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS plays_artist_track ON plays (artist, track, played_at);
+CREATE INDEX IF NOT EXISTS plays_played_at ON plays (played_at);
+CREATE INDEX IF NOT EXISTS plays_player_name_played_at ON plays (player_name, played_at);
+-- Statistics are queried from rollups which are updated in the same transaction as plays,
+-- so that queries don't scan all plays. Days are local dates and plays without player have empty player name.
+CREATE TABLE IF NOT EXISTS daily_plays (
+    day TEXT NOT NULL,
+    player_name TEXT NOT NULL,
+    status TEXT NOT NULL,
+    plays INTEGER NOT NULL,
+    PRIMARY KEY (day, player_name, status)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS daily_artist_plays (
+    day TEXT NOT NULL,
+    player_name TEXT NOT NULL,
+    artist TEXT NOT NULL,
+    status TEXT NOT NULL,
+    plays INTEGER NOT NULL,
+    PRIMARY KEY (day, player_name, artist, status)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS artist_plays (
+    player_name TEXT NOT NULL,
+    artist TEXT NOT NULL,
+    status TEXT NOT NULL,
+    plays INTEGER NOT NULL,
+    PRIMARY KEY (status, player_name, artist)
+) WITHOUT ROWID;
+-- Outcome of each play submitted to each scrobbling backend
+CREATE TABLE IF NOT EXISTS scrobbles (
+    id INTEGER PRIMARY KEY,
+    scrobbled_at INTEGER NOT NULL,
+    player_id INTEGER,
+    player_name TEXT,
+    artist TEXT NOT NULL,
+    track TEXT NOT NULL,
+    backend TEXT NOT NULL,
+    status TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS daily_scrobbles (
+    day TEXT NOT NULL,
+    player_name TEXT NOT NULL,
+    backend TEXT NOT NULL,
+    status TEXT NOT NULL,
+    scrobbles INTEGER NOT NULL,
+    PRIMARY KEY (day, player_name, backend, status)
+) WITHOUT ROWID;
+"""
+_INSERT_PLAY: Final[str] = """
+INSERT INTO plays (played_at, player_id, player_name, artist, track, album, duration, position, status)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+_UPDATE_DAILY_PLAYS: Final[str] = """
+INSERT INTO daily_plays (day, player_name, status, plays) VALUES (?, ?, ?, ?)
+ON CONFLICT (day, player_name, status) DO UPDATE SET plays = plays + excluded.plays
+"""
+_UPDATE_DAILY_ARTIST_PLAYS: Final[str] = """
+INSERT INTO daily_artist_plays (day, player_name, artist, status, plays) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (day, player_name, artist, status) DO UPDATE SET plays = plays + excluded.plays
+"""
+_UPDATE_ARTIST_PLAYS: Final[str] = """
+INSERT INTO artist_plays (player_name, artist, status, plays) VALUES (?, ?, ?, ?)
+ON CONFLICT (status, player_name, artist) DO UPDATE SET plays = plays + excluded.plays
+"""
+_INSERT_SCROBBLE: Final[str] = """
+INSERT INTO scrobbles (scrobbled_at, player_id, player_name, artist, track, backend, status)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+_UPDATE_DAILY_SCROBBLES: Final[str] = """
+INSERT INTO daily_scrobbles (day, player_name, backend, status, scrobbles) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (day, player_name, backend, status) DO UPDATE SET scrobbles = scrobbles + excluded.scrobbles
+"""
+
+
+class ScrobbleStatus(StrEnum):
+    # Play handed to scrobbling backends, their outcomes are recorded as scrobbles
+    SUBMITTED = "submitted"
+    SCROBBLED = "scrobbled"
+    SKIPPED = "skipped"
+    FAILED = "failed"
+
+
+@dataclasses.dataclass(frozen=True)
+class Play:
+    played_at: datetime
+    player_id: Optional[int]
+    player_name: Optional[str]
+    artist: str
+    track: str
+    album: Optional[str]
+    # HEOS uses ms for duration and position
+    duration: Optional[int]
+    position: Optional[int]
+    status: ScrobbleStatus
+
+
+@dataclasses.dataclass(frozen=True)
+class ScrobbleResult:
+    scrobbled_at: datetime
+    player_id: Optional[int]
+    player_name: Optional[str]
+    artist: str
+    track: str
+    backend: str
+    status: ScrobbleStatus
+
+
+def connect(path: str) -> sqlite3.Connection:
+    # Writes happen in worker threads, one batch at a time
+    connection = sqlite3.connect(path, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.executescript(_SCHEMA)
+
+    return connection
+
+
+def connect_read_only(path: str) -> sqlite3.Connection:
+    # Statistics never create the database nor change it
+    return sqlite3.connect(f"{Path(path).resolve().as_uri()}?mode=ro", uri=True)
+
+
+class ListeningHistory:
+    def __init__(self, path: str, batch_size: int):
+        self.path: str = path
+        self.batch_size: int = batch_size
+        self._queue: asyncio.Queue[Optional[Union[Play, ScrobbleResult]]] = asyncio.Queue()
+        self._connection: Optional[sqlite3.Connection] = None
+        self._task: Optional[asyncio.Task[None]] = None
+
+    def start(self) -> None:
+        self._connection = connect(self.path)
+        self._task = asyncio.create_task(self._write())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            # None tells the writer to write what is left in the queue and stop
+            self._queue.put_nowait(None)
+            await self._task
+            self._task = None
+
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def record(self, play: Play) -> None:
+        # Only enqueues so that callers on the event loop are never blocked by disk IO
+        self._queue.put_nowait(play)
+
+    def record_scrobble(self, result: ScrobbleResult) -> None:
+        self._queue.put_nowait(result)
+
+    async def _write(self) -> None:
+        stop = False
+
+        while not stop:
+            records: list[Union[Play, ScrobbleResult]] = []
+            record = await self._queue.get()
+
+            while record is not None:
+                records.append(record)
+
+                if len(records) >= self.batch_size or self._queue.empty():
+                    break
+
+                record = self._queue.get_nowait()
+
+            stop = record is None
+
+            if records:
+                try:
+                    await asyncio.to_thread(self._write_sync, records)
+                except sqlite3.Error:
+                    _logger.exception("Failed to write %s records to listening history", len(records))
+
+    def _write_sync(self, records: list[Union[Play, ScrobbleResult]]) -> None:
+        if self._connection is None:
+            raise RuntimeError("Listening history is not started")
+
+        plays = [record for record in records if isinstance(record, Play)]
+        scrobbles = [record for record in records if isinstance(record, ScrobbleResult)]
+
+        daily_plays: collections.Counter[tuple[str, str, str]] = collections.Counter()
+        daily_artist_plays: collections.Counter[tuple[str, str, str, str]] = collections.Counter()
+        artist_plays: collections.Counter[tuple[str, str, str]] = collections.Counter()
+
+        for play in plays:
+            # Naive times are local as in SQLite localtime
+            day = play.played_at.astimezone().date().isoformat()
+            player_name = play.player_name or ""
+            daily_plays[(day, player_name, play.status.value)] += 1
+            daily_artist_plays[(day, player_name, play.artist, play.status.value)] += 1
+            artist_plays[(player_name, play.artist, play.status.value)] += 1
+
+        daily_scrobbles: collections.Counter[tuple[str, str, str, str]] = collections.Counter()
+
+        for scrobble in scrobbles:
+            day = scrobble.scrobbled_at.astimezone().date().isoformat()
+            daily_scrobbles[(day, scrobble.player_name or "", scrobble.backend, scrobble.status.value)] += 1
+
+        with self._connection:
+            self._connection.executemany(
+                _INSERT_PLAY,
+                [
+                    (
+                        int(play.played_at.timestamp()),
+                        play.player_id,
+                        play.player_name,
+                        play.artist,
+                        play.track,
+                        play.album,
+                        play.duration,
+                        play.position,
+                        play.status.value,
+                    )
+                    for play in plays
+                ],
+            )
+            self._connection.executemany(_UPDATE_DAILY_PLAYS, [(*key, count) for key, count in daily_plays.items()])
+            self._connection.executemany(
+                _UPDATE_DAILY_ARTIST_PLAYS, [(*key, count) for key, count in daily_artist_plays.items()]
+            )
+            self._connection.executemany(_UPDATE_ARTIST_PLAYS, [(*key, count) for key, count in artist_plays.items()])
+            self._connection.executemany(
+                _INSERT_SCROBBLE,
+                [
+                    (
+                        int(scrobble.scrobbled_at.timestamp()),
+                        scrobble.player_id,
+                        scrobble.player_name,
+                        scrobble.artist,
+                        scrobble.track,
+                        scrobble.backend,
+                        scrobble.status.value,
+                    )
+                    for scrobble in scrobbles
+                ],
+            )
+            self._connection.executemany(
+                _UPDATE_DAILY_SCROBBLES, [(*key, count) for key, count in daily_scrobbles.items()]
+            )
+
+
+def _filter(player_name: Optional[str], since: Optional[date], until: Optional[date]) -> tuple[str, list[str]]:
+    conditions = ["1"]
+    parameters: list[str] = []
+
+    if player_name is not None:
+        conditions.append("player_name = ?")
+        parameters.append(player_name)
+
+    if since is not None:
+        conditions.append("day >= ?")
+        parameters.append(since.isoformat())
+
+    if until is not None:
+        conditions.append("day < ?")
+        parameters.append(until.isoformat())
+
+    # Conditions are constant strings, values are always passed as parameters
+    return " AND ".join(conditions), parameters
+
+
+def top_artists(
+    connection: sqlite3.Connection,
+    limit: int,
+    player_name: Optional[str] = None,
+    since: Optional[date] = None,
+    until: Optional[date] = None,
+) -> list[tuple[Optional[str], str, int]]:
+    condition, parameters = _filter(player_name=player_name, since=since, until=until)
+    # All time rollup is small, daily rollup is read only for the days of the period
+    table = "artist_plays" if since is None and until is None else "daily_artist_plays"
+
+    return connection.execute(
+        "SELECT NULLIF(player_name, ''), artist, plays FROM ("  # nosec B608
+        + " SELECT player_name, artist, SUM(plays) AS plays,"
+        + " ROW_NUMBER() OVER (PARTITION BY player_name ORDER BY SUM(plays) DESC) AS artist_rank"
+        + f" FROM {table} WHERE {condition} AND status != ? GROUP BY player_name, artist"
+        + ") WHERE artist_rank <= ? ORDER BY player_name, plays DESC",
+        [*parameters, ScrobbleStatus.SKIPPED.value, limit],
+    ).fetchall()
+
+
+def plays_per_day(
+    connection: sqlite3.Connection,
+    player_name: Optional[str] = None,
+    since: Optional[date] = None,
+    until: Optional[date] = None,
+) -> list[tuple[str, int]]:
+    condition, parameters = _filter(player_name=player_name, since=since, until=until)
+
+    return connection.execute(
+        "SELECT day, SUM(plays) FROM daily_plays"  # nosec B608
+        + f" WHERE {condition} AND status != ? GROUP BY day ORDER BY day",
+        [*parameters, ScrobbleStatus.SKIPPED.value],
+    ).fetchall()
+
+
+def scrobble_success_rate(
+    connection: sqlite3.Connection,
+    player_name: Optional[str] = None,
+    since: Optional[date] = None,
+    until: Optional[date] = None,
+    backend: Optional[str] = None,
+) -> Optional[float]:
+    condition, parameters = _filter(player_name=player_name, since=since, until=until)
+
+    if backend is not None:
+        condition += " AND backend = ?"
+        parameters.append(backend)
+
+    # Each scrobbling backend counts separately, skipped plays were never submitted
+    scrobbles_by_status = dict(
+        connection.execute(
+            "SELECT status, SUM(scrobbles) FROM daily_scrobbles"  # nosec B608
+            + f" WHERE {condition} GROUP BY status",
+            parameters,
+        ).fetchall()
+    )
+    scrobbled = scrobbles_by_status.get(ScrobbleStatus.SCROBBLED.value, 0)
+    failed = scrobbles_by_status.get(ScrobbleStatus.FAILED.value, 0)
+
+    if scrobbled + failed == 0:
+        return None
+
+    return scrobbled / (scrobbled + failed)
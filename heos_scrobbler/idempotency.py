@@ -0,0 +1,124 @@
+import hashlib
+import os
+from io import BufferedWriter
+from logging import Logger, getLogger
+from typing import Final, Optional
+
+_logger: Final[Logger] = getLogger(__name__)
+
+_KEY_SIZE: Final[int] = 8
+# Keys of the index file have the lowest bit set once the backend has acknowledged the submission
+_ACKNOWLEDGED: Final[int] = 1
+
+
+def create_idempotency_key(
+    backend: str, player_id: Optional[int], artist: str, track: str, started_at_timestamp: int
+) -> int:
+    # 64 bits makes collisions negligible for an index of recent submissions.
+    # Lowest bit is left for the state of the submission in the index file.
+    digest = hashlib.blake2b(
+        "\x1f".join([backend, str(player_id), artist.casefold(), track.casefold(), str(started_at_timestamp)]).encode(),
+        digest_size=_KEY_SIZE,
+    ).digest()
+
+    return int.from_bytes(digest) & ~_ACKNOWLEDGED
+
+
+class ScrobbleIndex:
+    # Bounded index of recently submitted scrobbles persisted to disk. Key is added as pending before the request
+    # and acknowledged once the backend has accepted it, so a crash or timeout in between leaves it pending.
+    # Keys are kept in two generations: when the current one is full the previous one is dropped,
+    # so at least capacity / 2 latest keys are always remembered and lookups stay O(1).
+    def __init__(self, path: str, capacity: int):
+        self.path: str = path
+        self._generation_size: int = max(1, capacity // 2)
+        # Key is mapped to whether its submission was acknowledged
+        self._current: dict[int, bool] = {}
+        self._previous: dict[int, bool] = {}
+        self._file: Optional[BufferedWriter] = None
+
+    def open(self) -> None:
+        submissions: dict[int, bool] = {}
+
+        if os.path.exists(self.path):
+            with open(self.path, "rb") as file:
+                data = file.read()
+
+            # Trailing partial key is left by a crash during write
+            for offset in range(0, len(data) - len(data) % _KEY_SIZE, _KEY_SIZE):
+                record = int.from_bytes(data[offset : offset + _KEY_SIZE])
+                key = record & ~_ACKNOWLEDGED
+                # Latest record of a key is the latest state, acknowledgement never reverts to pending
+                submissions[key] = submissions.pop(key, False) or bool(record & _ACKNOWLEDGED)
+
+        keys = list(submissions)
+        split = max(0, len(keys) - self._generation_size)
+        self._previous = {key: submissions[key] for key in keys[max(0, split - self._generation_size) : split]}
+        self._current = {key: submissions[key] for key in keys[split:]}
+        self._compact()
+
+        _logger.info("Scrobble index %s has %s recent submissions", self.path, len(self))
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __contains__(self, key: int) -> bool:
+        return key in self._current or key in self._previous
+
+    def __len__(self) -> int:
+        return len(self._current) + len(self._previous)
+
+    def is_acknowledged(self, key: int) -> bool:
+        return self._current.get(key, False) or self._previous.get(key, False)
+
+    def add_pending(self, key: int) -> None:
+        if key in self:
+            return
+
+        self._add(key, acknowledged=False)
+
+    def acknowledge(self, key: int) -> None:
+        if self.is_acknowledged(key):
+            return
+
+        self._add(key, acknowledged=True)
+
+    def _add(self, key: int, acknowledged: bool) -> None:
+        if self._file is None:
+            raise RuntimeError("Scrobble index is not opened")
+
+        self._previous.pop(key, None)
+
+        if key not in self._current and len(self._current) >= self._generation_size:
+            self._previous = self._current
+            self._current = {}
+            self._compact()
+
+        self._current[key] = acknowledged
+        self._file.write(self._record(key, acknowledged))
+        # Flushed to the OS right away so that keys survive a crash of the process
+        self._file.flush()
+
+    def _compact(self) -> None:
+        # File is rewritten with only the latest state of remembered keys, so it never grows beyond twice the capacity
+        self.close()
+
+        temporary_path = f"{self.path}.tmp"
+
+        with open(temporary_path, "wb") as file:
+            file.write(
+                b"".join(
+                    self._record(key, acknowledged)
+                    for key, acknowledged in [*self._previous.items(), *self._current.items()]
+                )
+            )
+
+        os.replace(temporary_path, self.path)
+
+        self._file = open(self.path, "ab")
+
+    @staticmethod
+    def _record(key: int, acknowledged: bool) -> bytes:
+        return (key | _ACKNOWLEDGED if acknowledged else key).to_bytes(_KEY_SIZE)
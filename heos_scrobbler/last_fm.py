@@ -1,32 +1,57 @@
-import asyncio
-from datetime import datetime
-from typing import Optional
+from typing import Optional, Union
 
 from pydantic import validate_call
-from pylast import LastFMNetwork, NetworkError, SessionKeyGenerator, WSError
+from pylast import LastFMNetwork, LibreFMNetwork, NetworkError, SessionKeyGenerator, WSError
 from pylast import md5 as pylast_md5
 
 from config import settings
+from heos_scrobbler.scrobbling import Scrobble, ScrobblingBackend, ScrobblingBackendRetryableException
 from heos_scrobbler.util import NotEmptyStr
 
 
-class LastFmScrobblerRetryableScrobbleException(Exception):
+class LastFmScrobblerRetryableScrobbleException(ScrobblingBackendRetryableException):
     pass
 
 
-class LastFmScrobbler:
+class LastFmScrobbler(ScrobblingBackend):
+    # Last.fm API accepts at most 50 scrobbles per track.scrobble request
+    max_batch_size: int = 50
+
     def __init__(self):
-        self.last_fm_network: LastFMNetwork = self._create_last_fm_network()
+        self.last_fm_network: Union[LastFMNetwork, LibreFMNetwork] = self._create_last_fm_network()
 
-    @validate_call
-    async def scrobble(
-        self, artist: NotEmptyStr, track: NotEmptyStr, scrobbled_at: datetime, album: Optional[str]
-    ) -> None:
-        # pylast is synchronous, but we want to wrap it as asyncio task
-        # so that callers can retry it with delay without blocking
-        coroutine = asyncio.to_thread(self._scrobble_sync, artist, track, scrobbled_at, album)
-        task = asyncio.create_task(coroutine)
-        await task
+    def scrobble_many(self, scrobbles: list[Scrobble]) -> None:
+        try:
+            self.last_fm_network.scrobble_many(
+                [
+                    {
+                        "artist": scrobble.artist,
+                        "title": scrobble.track,
+                        "timestamp": int(scrobble.scrobbled_at.timestamp()),
+                        "album": scrobble.album,
+                    }
+                    for scrobble in scrobbles
+                ]
+            )
+        except (NetworkError, WSError) as exc:
+            raise LastFmScrobblerRetryableScrobbleException from exc
+
+    def has_scrobbled(self, scrobble: Scrobble) -> Optional[bool]:
+        timestamp = int(scrobble.scrobbled_at.timestamp())
+
+        try:
+            played_tracks = self.last_fm_network.get_user(self.last_fm_network.username).get_recent_tracks(
+                limit=None, time_from=timestamp - 1, time_to=timestamp + 1
+            )
+        except (NetworkError, WSError) as exc:
+            raise LastFmScrobblerRetryableScrobbleException from exc
+
+        # Artist and album may have been corrected by the service, so only the title is compared
+        return any(
+            played_track.timestamp == str(timestamp)
+            and (played_track.track.get_name() or "").casefold() == scrobble.track.casefold()
+            for played_track in played_tracks
+        )
 
     @validate_call
     def update_now_playing(self, artist: NotEmptyStr, track: NotEmptyStr, duration: int, album: Optional[str]) -> None:
@@ -41,21 +66,8 @@ class LastFmScrobbler:
             # No need to retry as now playing track is relevant only for the duration of it
             pass
 
-    def _scrobble_sync(
-        self, artist: NotEmptyStr, track: NotEmptyStr, scrobbled_at: datetime, album: Optional[str]
-    ) -> None:
-        try:
-            self.last_fm_network.scrobble(
-                artist=artist,
-                title=track,
-                timestamp=int(scrobbled_at.timestamp()),
-                album=album,
-            )
-        except (NetworkError, WSError) as exc:
-            raise LastFmScrobblerRetryableScrobbleException from exc
-
     @staticmethod
-    def _create_last_fm_network() -> LastFMNetwork:
+    def _create_last_fm_network() -> Union[LastFMNetwork, LibreFMNetwork]:
         temporary_last_fm_network = LastFMNetwork(
             api_key=settings.last_fm.api_key, api_secret=settings.last_fm.api_secret
         )
@@ -70,4 +82,19 @@ class LastFmScrobbler:
             api_key=settings.last_fm.api_key,
             api_secret=settings.last_fm.api_secret,
             session_key=session_key,
+            # Needed to look up recent scrobbles of the user
+            username=settings.last_fm.username,
+        )
+
+
+class LibreFmScrobbler(LastFmScrobbler):
+    # Libre.fm implements the Last.fm API, only the network differs
+    @staticmethod
+    def _create_last_fm_network() -> Union[LastFMNetwork, LibreFMNetwork]:
+        # LibreFMNetwork fetches the session key itself
+        return LibreFMNetwork(
+            api_key=settings.libre_fm.api_key,
+            api_secret=settings.libre_fm.api_secret,
+            username=settings.libre_fm.username,
+            password_hash=pylast_md5(settings.libre_fm.password),
         )
@@ -0,0 +1,115 @@
+import json
+import urllib.error
+import urllib.request
+from typing import Any, Final, Optional
+from urllib.parse import quote, urlencode, urlparse
+
+from pydantic import validate_call
+
+from heos_scrobbler.scrobbling import Scrobble, ScrobblingBackend, ScrobblingBackendRetryableException
+from heos_scrobbler.util import NotEmptyStr
+
+_REQUEST_TIMEOUT_SECONDS: Final[int] = 30
+
+
+class ListenBrainzScrobblerRetryableScrobbleException(ScrobblingBackendRetryableException):
+    pass
+
+
+class ListenBrainzScrobbler(ScrobblingBackend):
+    # ListenBrainz API accepts at most 1000 listens per submit-listens request
+    max_batch_size: int = 1000
+
+    def __init__(self, url: str, token: str):
+        if urlparse(url).scheme not in ("http", "https"):
+            raise ValueError(f"ListenBrainz URL must be http(s), got {url}")
+
+        self.url: str = url.rstrip("/")
+        self.token: str = token
+        self._user_name: Optional[str] = None
+
+    def scrobble_many(self, scrobbles: list[Scrobble]) -> None:
+        try:
+            self._submit_listens(
+                listen_type="single" if len(scrobbles) == 1 else "import",
+                payload=[
+                    {
+                        "listened_at": int(scrobble.scrobbled_at.timestamp()),
+                        "track_metadata": self._track_metadata(
+                            artist=scrobble.artist, track=scrobble.track, album=scrobble.album
+                        ),
+                    }
+                    for scrobble in scrobbles
+                ],
+            )
+        except urllib.error.HTTPError as exc:
+            # Rate limited or server side failure, other errors won't be fixed by retrying
+            if exc.code == 429 or exc.code >= 500:
+                raise ListenBrainzScrobblerRetryableScrobbleException from exc
+
+            raise
+        except (urllib.error.URLError, TimeoutError) as exc:
+            raise ListenBrainzScrobblerRetryableScrobbleException from exc
+
+    def has_scrobbled(self, scrobble: Scrobble) -> Optional[bool]:
+        listened_at = int(scrobble.scrobbled_at.timestamp())
+
+        try:
+            if self._user_name is None:
+                self._user_name = str(self._get("/1/validate-token")["user_name"])
+
+            # Latest listens before max_ts, only one of min_ts and max_ts can be given
+            query = urlencode({"max_ts": listened_at + 1, "count": 10})
+            listens = self._get(f"/1/user/{quote(self._user_name)}/listens?{query}")["payload"]["listens"]
+        except urllib.error.HTTPError as exc:
+            if exc.code == 429 or exc.code >= 500:
+                raise ListenBrainzScrobblerRetryableScrobbleException from exc
+
+            raise
+        except (urllib.error.URLError, TimeoutError) as exc:
+            raise ListenBrainzScrobblerRetryableScrobbleException from exc
+
+        return any(
+            listen["listened_at"] == listened_at
+            and listen["track_metadata"]["track_name"].casefold() == scrobble.track.casefold()
+            for listen in listens
+        )
+
+    @validate_call
+    def update_now_playing(self, artist: NotEmptyStr, track: NotEmptyStr, duration: int, album: Optional[str]) -> None:
+        track_metadata = self._track_metadata(artist=artist, track=track, album=album)
+        track_metadata["additional_info"] = {"duration_ms": duration * 1000}
+
+        try:
+            self._submit_listens(listen_type="playing_now", payload=[{"track_metadata": track_metadata}])
+        except (urllib.error.URLError, TimeoutError):
+            # No need to retry as now playing track is relevant only for the duration of it
+            pass
+
+    def _submit_listens(self, listen_type: str, payload: list[dict[str, Any]]) -> None:
+        request = urllib.request.Request(
+            f"{self.url}/1/submit-listens",
+            data=json.dumps({"listen_type": listen_type, "payload": payload}).encode(),
+            headers={"Authorization": f"Token {self.token}", "Content-Type": "application/json"},
+            method="POST",
+        )
+
+        # URL scheme is validated in __init__
+        with urllib.request.urlopen(request, timeout=_REQUEST_TIMEOUT_SECONDS):  # nosec B310
+            pass
+
+    def _get(self, path: str) -> dict[str, Any]:
+        request = urllib.request.Request(f"{self.url}{path}", headers={"Authorization": f"Token {self.token}"})
+
+        # URL scheme is validated in __init__
+        with urllib.request.urlopen(request, timeout=_REQUEST_TIMEOUT_SECONDS) as response:  # nosec B310
+            return json.loads(response.read())
+
+    @staticmethod
+    def _track_metadata(artist: str, track: str, album: Optional[str]) -> dict[str, Any]:
+        track_metadata: dict[str, Any] = {"artist_name": artist, "track_name": track}
+
+        if album:
+            track_metadata["release_name"] = album
+
+        return track_metadata
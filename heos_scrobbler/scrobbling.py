@@ -0,0 +1,298 @@
+import asyncio
+import dataclasses
+import functools
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime
+from logging import Logger, getLogger
+from typing import Any, Callable, Final, Optional
+
+from pydantic import validate_call
+
+from heos_scrobbler.history import ListeningHistory, ScrobbleResult, ScrobbleStatus
+from heos_scrobbler.idempotency import ScrobbleIndex, create_idempotency_key
+from heos_scrobbler.util import NotEmptyStr, retry
+
+_logger: Final[Logger] = getLogger(__name__)
+
+
+@dataclasses.dataclass(frozen=True)
+class Scrobble:
+    artist: str
+    track: str
+    scrobbled_at: datetime
+    album: Optional[str]
+    player_id: Optional[int] = None
+    player_name: Optional[str] = None
+
+
+class ScrobblingBackendRetryableException(Exception):
+    pass
+
+
+class ScrobblingBackend(ABC):
+    # Maximum amount of scrobbles the service accepts in one request
+    max_batch_size: int = 1
+
+    # Both are synchronous and called from worker threads, one request at a time per backend
+
+    @abstractmethod
+    def scrobble_many(self, scrobbles: list[Scrobble]) -> None:
+        pass
+
+    @abstractmethod
+    def update_now_playing(self, artist: str, track: str, duration: int, album: Optional[str]) -> None:
+        pass
+
+    def has_scrobbled(self, scrobble: Scrobble) -> Optional[bool]:
+        # Whether the service already has the scrobble, None when the service can't tell
+        return None
+
+
+class ScrobblingBackendQueue:
+    def __init__(
+        self,
+        name: str,
+        backend: ScrobblingBackend,
+        batch_size: int,
+        min_request_interval: float,
+        retry_scrobble_for_hours: float,
+        scrobble_index: Optional[ScrobbleIndex] = None,
+    ):
+        self.name: str = name
+        self.backend: ScrobblingBackend = backend
+        self.batch_size: int = max(1, min(batch_size, backend.max_batch_size))
+        self.min_request_interval: float = min_request_interval
+        self.scrobble_index: Optional[ScrobbleIndex] = scrobble_index
+        self._scrobbles: asyncio.Queue[tuple[Scrobble, asyncio.Future[None]]] = asyncio.Queue()
+        # Only the latest now playing track is relevant, older ones are replaced
+        self._now_playing: Optional[dict[str, Any]] = None
+        self._now_playing_updated: asyncio.Event = asyncio.Event()
+        self._request_lock: asyncio.Lock = asyncio.Lock()
+        self._last_request_at: float = float("-inf")
+        self._tasks: list[asyncio.Task[None]] = []
+        self._submit_scrobbles_with_retry = retry(
+            max_delay=int(retry_scrobble_for_hours * 60 * 60), retry_on=ScrobblingBackendRetryableException
+        )(self._submit_scrobbles)
+
+    def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._process_scrobbles()), asyncio.create_task(self._process_now_playing())]
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        while not self._scrobbles.empty():
+            _, result = self._scrobbles.get_nowait()
+            result.cancel()
+
+    def scrobble(self, scrobble: Scrobble) -> asyncio.Future[None]:
+        result: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        self._scrobbles.put_nowait((scrobble, result))
+
+        return result
+
+    def update_now_playing(self, artist: str, track: str, duration: int, album: Optional[str]) -> None:
+        self._now_playing = {"artist": artist, "track": track, "duration": duration, "album": album}
+        self._now_playing_updated.set()
+
+    async def _process_scrobbles(self) -> None:
+        while True:
+            batch = [await self._scrobbles.get()]
+
+            while len(batch) < self.batch_size and not self._scrobbles.empty():
+                batch.append(self._scrobbles.get_nowait())
+
+            # Waiters may have been cancelled, e.g. on shutdown
+            batch = [(scrobble, result) for scrobble, result in batch if not result.done()]
+
+            if batch:
+                await self._submit_batch(batch)
+
+    async def _submit_batch(self, batch: list[tuple[Scrobble, asyncio.Future[None]]]) -> None:
+        try:
+            await self._submit_scrobbles_with_retry([scrobble for scrobble, _ in batch])
+        except asyncio.CancelledError:
+            # Closed while the batch was in flight or waiting for retry
+            for _, result in batch:
+                result.cancel()
+
+            raise
+        except Exception as exc:
+            # Non-retryable error may be caused by a single scrobble, it must not fail the others of the batch.
+            # Batch which ran out of retries is not split as the backend has been unavailable.
+            if len(batch) > 1 and not isinstance(exc.__cause__, ScrobblingBackendRetryableException):
+                _logger.warning("%s rejected %s scrobbles, submitting them one by one: %s", self.name, len(batch), exc)
+
+                for item in batch:
+                    await self._submit_batch([item])
+
+                return
+
+            _logger.warning("%s failed to submit %s scrobbles: %s", self.name, len(batch), exc)
+
+            for _, result in batch:
+                if not result.done():
+                    result.set_exception(exc)
+        else:
+            for _, result in batch:
+                if not result.done():
+                    result.set_result(None)
+
+    async def _process_now_playing(self) -> None:
+        while True:
+            await self._now_playing_updated.wait()
+            self._now_playing_updated.clear()
+
+            if self._now_playing is None:
+                continue
+
+            try:
+                await self._request(self.backend.update_now_playing, **self._now_playing)
+            except Exception as exc:
+                # No need to retry as now playing track is relevant only for the duration of it
+                _logger.debug("%s failed to update now playing: %s", self.name, exc)
+
+    async def _submit_scrobbles(self, scrobbles: list[Scrobble]) -> None:
+        if self.scrobble_index is None:
+            await self._request(self.backend.scrobble_many, scrobbles)
+            return
+
+        # Checked again on every retry, e.g. when the same play was queued twice
+        keys: dict[int, Scrobble] = {}
+
+        for scrobble in scrobbles:
+            key = create_idempotency_key(
+                backend=self.name,
+                player_id=scrobble.player_id,
+                artist=scrobble.artist,
+                track=scrobble.track,
+                started_at_timestamp=int(scrobble.scrobbled_at.timestamp()),
+            )
+
+            if key in keys or self.scrobble_index.is_acknowledged(key):
+                _logger.info("%s already has scrobble %s - %s, skipping", self.name, scrobble.artist, scrobble.track)
+                continue
+
+            # Previous request timed out or the process crashed after sending it, the service may have accepted it.
+            # Service is asked instead of guessing, scrobble is submitted again if the service can't tell.
+            if key in self.scrobble_index and await self._request(self.backend.has_scrobbled, scrobble):
+                _logger.info("%s had accepted scrobble %s - %s, skipping", self.name, scrobble.artist, scrobble.track)
+                self.scrobble_index.acknowledge(key)
+                continue
+
+            keys[key] = scrobble
+
+        if not keys:
+            return
+
+        # Written to disk before the request so that a crash during it is noticed on next submission
+        for key in keys:
+            self.scrobble_index.add_pending(key)
+
+        await self._request(self.backend.scrobble_many, list(keys.values()))
+
+        for key in keys:
+            self.scrobble_index.acknowledge(key)
+
+    async def _request[T](self, operation: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        # Requests of one backend are serialized and spaced so that rate limits of the service are respected
+        async with self._request_lock:
+            delay = self._last_request_at + self.min_request_interval - time.monotonic()
+
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            try:
+                return await asyncio.to_thread(operation, *args, **kwargs)
+            finally:
+                self._last_request_at = time.monotonic()
+
+
+class ScrobblingBackends:
+    def __init__(
+        self,
+        queues: list[ScrobblingBackendQueue],
+        scrobble_index: Optional[ScrobbleIndex] = None,
+        listening_history: Optional[ListeningHistory] = None,
+    ):
+        self.queues: list[ScrobblingBackendQueue] = queues
+        self.scrobble_index: Optional[ScrobbleIndex] = scrobble_index
+        self.listening_history: Optional[ListeningHistory] = listening_history
+
+    def start(self) -> None:
+        for queue in self.queues:
+            queue.start()
+
+    async def close(self) -> None:
+        await asyncio.gather(*[queue.close() for queue in self.queues])
+
+        if self.scrobble_index is not None:
+            self.scrobble_index.close()
+
+    @validate_call
+    def scrobble(
+        self,
+        artist: NotEmptyStr,
+        track: NotEmptyStr,
+        scrobbled_at: datetime,
+        album: Optional[str],
+        player_id: Optional[int] = None,
+        player_name: Optional[str] = None,
+    ) -> asyncio.Future[None]:
+        # Scrobble is queued right away, the returned future completes once all backends are done with it
+        scrobble = Scrobble(
+            artist=artist,
+            track=track,
+            scrobbled_at=scrobbled_at,
+            album=album,
+            player_id=player_id,
+            player_name=player_name,
+        )
+        # Each backend has its own queue so a slow or unavailable backend does not delay the others
+        results: list[asyncio.Future[None]] = []
+
+        for queue in self.queues:
+            result = queue.scrobble(scrobble)
+            result.add_done_callback(functools.partial(self._record, scrobble, queue.name))
+            results.append(result)
+
+        return asyncio.ensure_future(self._wait(results))
+
+    @staticmethod
+    async def _wait(results: list[asyncio.Future[None]]) -> None:
+        failures = [
+            result
+            for result in await asyncio.gather(*results, return_exceptions=True)
+            if isinstance(result, BaseException)
+        ]
+
+        if failures:
+            raise failures[0]
+
+    def _record(self, scrobble: Scrobble, backend: str, result: asyncio.Future[None]) -> None:
+        if self.listening_history is None:
+            return
+
+        # Scrobbles cancelled on shutdown are lost as well
+        self.listening_history.record_scrobble(
+            ScrobbleResult(
+                scrobbled_at=scrobble.scrobbled_at,
+                player_id=scrobble.player_id,
+                player_name=scrobble.player_name,
+                artist=scrobble.artist,
+                track=scrobble.track,
+                backend=backend,
+                status=ScrobbleStatus.SCROBBLED
+                if not result.cancelled() and result.exception() is None
+                else ScrobbleStatus.FAILED,
+            )
+        )
+
+    @validate_call
+    def update_now_playing(self, artist: NotEmptyStr, track: NotEmptyStr, duration: int, album: Optional[str]) -> None:
+        for queue in self.queues:
+            queue.update_now_playing(artist=artist, track=track, duration=duration, album=album)
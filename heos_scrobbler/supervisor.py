@@ -0,0 +1,339 @@
+import asyncio
+import dataclasses
+import functools
+import hashlib
+import multiprocessing
+import queue
+import signal
+import time
+from logging import Logger, getLogger
+from multiprocessing.process import BaseProcess
+from multiprocessing.queues import Queue
+from multiprocessing.sharedctypes import Synchronized
+from multiprocessing.synchronize import Event
+from typing import Any, Final, Optional
+
+from pydantic import ValidationError
+
+from config import settings
+from heos_scrobbler.diagnostics import add_diagnostics_signal_handlers
+from heos_scrobbler.heos import (
+    _discover_heos_devices,
+    create_scrobbling_backends,
+    initialize_heos_scrobbling,
+    shutdown_heos_scrobbling,
+)
+from heos_scrobbler.history import ListeningHistory
+from heos_scrobbler.scrobbling import Scrobble, ScrobblingBackend, ScrobblingBackendQueue, ScrobblingBackends
+from heos_scrobbler.util import add_shutdown_signal_handlers
+
+_logger: Final[Logger] = getLogger(__name__)
+
+ScrobbleQueue = Queue[Optional[tuple[str, dict[str, Any]]]]
+
+
+def assign_heos_devices(heos_device_ips: list[str], workers: int) -> list[list[str]]:
+    # Rendezvous hashing: each device goes to the worker with the highest score,
+    # so when devices come or go only those devices move between workers.
+    # Built-in hash() is salted per process so it can't be used here.
+    assignments: list[list[str]] = [[] for _ in range(workers)]
+
+    for heos_device_ip in sorted(heos_device_ips):
+        worker = max(
+            range(workers),
+            key=lambda worker: hashlib.blake2b(f"{worker}/{heos_device_ip}".encode(), digest_size=8).digest(),
+        )
+        assignments[worker].append(heos_device_ip)
+
+    return assignments
+
+
+class ScrobbleSubmitterClient(ScrobblingBackend):
+    # Forwards requests to scrobbling backends running in the scrobble submitter process
+    def __init__(self, scrobble_queue: ScrobbleQueue):
+        self.scrobble_queue: ScrobbleQueue = scrobble_queue
+
+    def scrobble_many(self, scrobbles: list[Scrobble]) -> None:
+        for scrobble in scrobbles:
+            self.scrobble_queue.put_nowait(("scrobble", dataclasses.asdict(scrobble)))
+
+    def update_now_playing(self, artist: str, track: str, duration: int, album: Optional[str]) -> None:
+        self.scrobble_queue.put_nowait(
+            ("update_now_playing", {"artist": artist, "track": track, "duration": duration, "album": album})
+        )
+
+
+class Supervisor:
+    def __init__(self, workers: int):
+        self.workers: int = workers
+        # Spawn is the only start method available on every platform and is safe with threads
+        self._context = multiprocessing.get_context("spawn")
+        # Replaced for each scrobble submitter, see _start_submitter
+        self._scrobble_queue: ScrobbleQueue = self._context.Queue()
+        # Scrobbles taken from the queue by the submitter but not yet accepted or given up by scrobbling backends
+        self._in_flight_scrobbles: "Synchronized[int]" = self._context.Value("i", 0)
+        self._submitter: Optional[BaseProcess] = None
+        self._worker_processes: dict[int, BaseProcess] = {}
+        # Setting the event asks the worker to shut down gracefully, signals can't do that on every platform
+        self._worker_shutdown_requests: dict[int, Event] = {}
+        self._assignments: dict[int, list[str]] = {}
+
+    async def run(self, shutdown_event: asyncio.Event) -> None:
+        heos_device_ips: list[str] = []
+        discovered_at: Optional[float] = None
+
+        try:
+            while not shutdown_event.is_set():
+                if (
+                    discovered_at is None
+                    or time.monotonic() - discovered_at >= settings.supervisor.rediscovery_interval_seconds
+                ):
+                    heos_device_ips = await self._discover(previous_heos_device_ips=heos_device_ips)
+                    discovered_at = time.monotonic()
+
+                if self._submitter is None or not self._submitter.is_alive():
+                    await self._start_submitter()
+
+                await self._reconcile(heos_device_ips)
+
+                try:
+                    await asyncio.wait_for(shutdown_event.wait(), timeout=settings.supervisor.check_interval_seconds)
+                except TimeoutError:
+                    pass
+        finally:
+            await self._stop()
+
+    async def _discover(self, previous_heos_device_ips: list[str]) -> list[str]:
+        heos_device_ips = await _discover_heos_devices()
+
+        # Missing responses are more likely a network glitch than all devices being gone
+        if len(heos_device_ips) == 0:
+            _logger.warning("No HEOS devices found, keeping previous devices %s", previous_heos_device_ips)
+            return previous_heos_device_ips
+
+        if set(heos_device_ips) != set(previous_heos_device_ips):
+            _logger.info("Found HEOS devices with following IP addresses:\n%s", heos_device_ips)
+
+        return heos_device_ips
+
+    async def _reconcile(self, heos_device_ips: list[str]) -> None:
+        for worker, assigned_heos_device_ips in enumerate(assign_heos_devices(heos_device_ips, self.workers)):
+            process = self._worker_processes.get(worker)
+
+            if process is not None and process.is_alive() and self._assignments.get(worker) == assigned_heos_device_ips:
+                continue
+
+            if process is not None:
+                if process.is_alive():
+                    _logger.info("Rebalancing HEOS devices of worker %s", worker)
+                    await self._stop_process(process, self._worker_shutdown_requests[worker])
+                else:
+                    _logger.warning("Worker %s exited with code %s, restarting", worker, process.exitcode)
+
+                del self._worker_processes[worker]
+                del self._worker_shutdown_requests[worker]
+
+            self._assignments[worker] = assigned_heos_device_ips
+
+            if assigned_heos_device_ips:
+                self._worker_shutdown_requests[worker] = self._context.Event()
+                self._worker_processes[worker] = self._start_process(
+                    _run_worker,
+                    assigned_heos_device_ips,
+                    self._worker_shutdown_requests[worker],
+                    self._scrobble_queue,
+                    name=f"heos-scrobbler-worker-{worker}",
+                )
+                _logger.info("Worker %s handles HEOS devices %s", worker, assigned_heos_device_ips)
+
+    async def _start_submitter(self) -> None:
+        if self._submitter is not None:
+            _logger.warning("Scrobble submitter exited with code %s, restarting", self._submitter.exitcode)
+
+            with self._in_flight_scrobbles.get_lock():
+                if self._in_flight_scrobbles.value > 0:
+                    _logger.warning(
+                        "%s scrobbles in flight were lost with the scrobble submitter", self._in_flight_scrobbles.value
+                    )
+
+                self._in_flight_scrobbles.value = 0
+
+            # Submitter killed while reading the queue never releases its read lock, so the new submitter gets
+            # a queue of its own. Workers are restarted by the next reconcile to send their scrobbles to it.
+            await self._stop_workers()
+            self._scrobble_queue = self._context.Queue()
+
+        self._submitter = self._start_process(
+            _run_submitter, self._in_flight_scrobbles, self._scrobble_queue, name="heos-scrobbler-submitter"
+        )
+
+    def _start_process(self, target: Any, *args: Any, name: str) -> BaseProcess:
+        process = self._context.Process(target=target, args=args, name=name, daemon=True)
+        process.start()
+        # Diagnostics signals are sent to a specific process
+        _logger.info("Started process %s with PID %s", name, process.pid)
+
+        return process
+
+    async def _stop(self) -> None:
+        # Workers are stopped first so that everything they send reaches the submitter
+        await self._stop_workers()
+
+        if self._submitter is not None:
+            self._scrobble_queue.put(None)
+            await asyncio.to_thread(self._submitter.join, settings.shutdown_timeout_seconds * 2)
+
+            if self._submitter.is_alive():
+                self._submitter.terminate()
+
+            self._submitter = None
+
+    async def _stop_workers(self) -> None:
+        await asyncio.gather(
+            *[
+                self._stop_process(process, self._worker_shutdown_requests[worker])
+                for worker, process in self._worker_processes.items()
+            ]
+        )
+        self._worker_processes = {}
+        self._worker_shutdown_requests = {}
+        self._assignments = {}
+
+    @staticmethod
+    async def _stop_process(process: BaseProcess, shutdown_request: Event) -> None:
+        # Triggers graceful shutdown in the worker, terminate() would kill it right away on Windows
+        shutdown_request.set()
+        await asyncio.to_thread(process.join, settings.shutdown_timeout_seconds * 2)
+
+        if process.is_alive():
+            _logger.warning("Process %s did not stop in time, killing it", process.name)
+            process.kill()
+
+
+def _run_worker(
+    heos_device_ips: list[str], shutdown_request: Event, scrobble_queue: ScrobbleQueue
+) -> None:  # pragma: no cover
+    asyncio.run(_work(heos_device_ips, shutdown_request, scrobble_queue))
+
+
+async def _work(heos_device_ips: list[str], shutdown_request: Event, scrobble_queue: ScrobbleQueue) -> None:
+    shutdown_event = asyncio.Event()
+    add_shutdown_signal_handlers(shutdown_event)
+    add_diagnostics_signal_handlers()
+    shutdown_request_task = asyncio.create_task(_wait_for_shutdown_request(shutdown_request, shutdown_event))
+
+    # Retrying failed scrobbles and rate limiting are the responsibility of the submitter
+    scrobbling_backends = ScrobblingBackends(
+        queues=[
+            ScrobblingBackendQueue(
+                name="submitter",
+                backend=ScrobbleSubmitterClient(scrobble_queue),
+                batch_size=1,
+                min_request_interval=0,
+                retry_scrobble_for_hours=0,
+            )
+        ]
+    )
+    heos_scrobbling = await initialize_heos_scrobbling(
+        heos_device_ips=heos_device_ips, scrobbling_backends=scrobbling_backends
+    )
+
+    await shutdown_event.wait()
+    # Releases the thread waiting for the request when shut down by a signal
+    shutdown_request.set()
+    await shutdown_request_task
+
+    await shutdown_heos_scrobbling(heos_scrobbling, timeout=settings.shutdown_timeout_seconds)
+
+
+async def _wait_for_shutdown_request(shutdown_request: Event, shutdown_event: asyncio.Event) -> None:
+    await asyncio.to_thread(shutdown_request.wait)
+    shutdown_event.set()
+
+
+def _run_submitter(in_flight_scrobbles: "Synchronized[int]", scrobble_queue: ScrobbleQueue) -> None:  # pragma: no cover
+    # Submitter is stopped by the supervisor once workers have stopped, not by signals sent to the process group
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    asyncio.run(_start_submitting(scrobble_queue, in_flight_scrobbles))
+
+
+async def _start_submitting(
+    scrobble_queue: ScrobbleQueue, in_flight_scrobbles: "Synchronized[int]"
+) -> None:  # pragma: no cover
+    # Diagnostics of the submitter show tasks, memory and event loop of submitting scrobbles to scrobbling backends
+    add_diagnostics_signal_handlers()
+    listening_history: Optional[ListeningHistory] = None
+
+    # Workers record plays, outcomes of scrobbling backends are known only here
+    if settings.history.enabled:
+        listening_history = ListeningHistory(path=settings.history.path, batch_size=settings.history.batch_size)
+        listening_history.start()
+
+    try:
+        await _submit(
+            scrobble_queue, create_scrobbling_backends(listening_history=listening_history), in_flight_scrobbles
+        )
+    finally:
+        if listening_history is not None:
+            await listening_history.close()
+
+
+async def _submit(
+    scrobble_queue: ScrobbleQueue, scrobbling_backends: ScrobblingBackends, in_flight_scrobbles: "Synchronized[int]"
+) -> None:
+    pending_scrobbles: set[asyncio.Future[None]] = set()
+
+    scrobbling_backends.start()
+
+    while (message := await _receive(scrobble_queue)) is not None:
+        operation, kwargs = message
+
+        if operation == "scrobble":
+            try:
+                result = scrobbling_backends.scrobble(**kwargs)
+            except ValidationError:
+                _logger.warning("Scrobble not suitable for scrobbling: %s", kwargs)
+                continue
+
+            with in_flight_scrobbles.get_lock():
+                in_flight_scrobbles.value += 1
+
+            pending_scrobbles.add(result)
+            result.add_done_callback(pending_scrobbles.discard)
+            result.add_done_callback(functools.partial(_scrobble_done, kwargs, in_flight_scrobbles))
+        elif operation == "update_now_playing":
+            scrobbling_backends.update_now_playing(**kwargs)
+        else:
+            _logger.warning("Unknown scrobble submitter operation %s", operation)
+
+    if pending_scrobbles:
+        _, pending = await asyncio.wait(pending_scrobbles, timeout=settings.shutdown_timeout_seconds)
+
+        if pending:
+            _logger.warning("%s pending scrobbles could not be submitted before shutdown", len(pending))
+
+    await scrobbling_backends.close()
+
+
+async def _receive(scrobble_queue: ScrobbleQueue) -> Optional[tuple[str, dict[str, Any]]]:
+    # Waiting with a timeout lets the thread return, otherwise the event loop could not be closed
+    # until the next message arrives
+    while True:
+        try:
+            return await asyncio.to_thread(scrobble_queue.get, timeout=settings.supervisor.check_interval_seconds)
+        except queue.Empty:
+            continue
+
+
+def _scrobble_done(
+    scrobble: dict[str, Any], in_flight_scrobbles: "Synchronized[int]", result: asyncio.Future[None]
+) -> None:
+    with in_flight_scrobbles.get_lock():
+        in_flight_scrobbles.value -= 1
+
+    if result.cancelled():
+        _logger.warning("Scrobble %s - %s was cancelled", scrobble["artist"], scrobble["track"])
+    elif (exc := result.exception()) is not None:
+        _logger.warning("Failed to scrobble %s - %s: %s", scrobble["artist"], scrobble["track"], exc)
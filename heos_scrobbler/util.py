@@ -1,5 +1,6 @@
 import asyncio
 import copy
+import signal
 from logging import Logger, getLogger
 from typing import Annotated, Any, Awaitable, Callable, Final, Sequence, Type, Union
 
@@ -29,6 +30,17 @@ class State:
         self._value = copy.replace(value)
 
 
+def add_shutdown_signal_handlers(shutdown_event: asyncio.Event) -> None:
+    loop = asyncio.get_running_loop()
+
+    for shutdown_signal in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(shutdown_signal, shutdown_event.set)
+        except NotImplementedError:
+            # Windows event loops do not support add_signal_handler
+            signal.signal(shutdown_signal, lambda *_: loop.call_soon_threadsafe(shutdown_event.set))
+
+
 def retry[T, **P](
     max_delay: int, retry_on: Union[Type[Exception], Sequence[Type[Exception]]]
 ) -> Callable[[Callable[P, Awaitable[T]]], Callable[P, Awaitable[T]]]:
@@ -1,21 +1,51 @@
 import asyncio
 import logging
+from typing import Callable, Optional
 
 from config import settings
-from heos_scrobbler.heos import initialize_heos_scrobbling
+from heos_scrobbler.diagnostics import add_diagnostics_signal_handlers
+from heos_scrobbler.heos import initialize_heos_scrobbling, shutdown_heos_scrobbling
+from heos_scrobbler.supervisor import Supervisor
+from heos_scrobbler.util import add_shutdown_signal_handlers
 
 logging.basicConfig(
     format="%(asctime)s|%(levelname)s|%(name)s|%(module)s.%(funcName)s: %(message)s",
     level=logging.DEBUG if settings.debug else logging.INFO,
 )
 
+_logger = logging.getLogger(__name__)
+
+
+def _get_event_loop_factory() -> Optional[Callable[[], asyncio.AbstractEventLoop]]:
+    if not settings.use_uvloop:
+        return None
+
+    try:
+        import uvloop  # pyright: ignore [reportMissingImports]
+    except ImportError:
+        _logger.warning("uvloop is not installed, using default asyncio event loop")
+        return None
+
+    _logger.info("Using uvloop event loop")
+
+    return uvloop.new_event_loop
+
 
 async def main():
-    await initialize_heos_scrobbling()
+    shutdown_event = asyncio.Event()
+    add_shutdown_signal_handlers(shutdown_event)
+    add_diagnostics_signal_handlers()
+
+    if settings.supervisor.workers > 0:
+        await Supervisor(workers=settings.supervisor.workers).run(shutdown_event)
+        return
+
+    heos_scrobbling = await initialize_heos_scrobbling()
+
+    await shutdown_event.wait()
 
-    while True:
-        await asyncio.sleep(1)
+    await shutdown_heos_scrobbling(heos_scrobbling, timeout=settings.shutdown_timeout_seconds)
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    asyncio.run(main(), loop_factory=_get_event_loop_factory())
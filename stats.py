@@ -0,0 +1,57 @@
+import argparse
+import os
+from datetime import date
+
+from config import settings
+from heos_scrobbler.history import connect_read_only, plays_per_day, scrobble_success_rate, top_artists
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Statistics of tracks listened with HEOS devices")
+    parser.add_argument("--player", help="Name of the HEOS player (room), all players by default")
+    parser.add_argument("--since", type=date.fromisoformat, help="First day of the period, e.g. 2025-01-01")
+    parser.add_argument("--until", type=date.fromisoformat, help="End of the period (exclusive), e.g. 2026-01-01")
+
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    top_artists_parser = subparsers.add_parser("top-artists", help="Most played artists per player")
+    top_artists_parser.add_argument("--limit", type=int, default=10, help="Amount of artists per player")
+
+    subparsers.add_parser("plays-per-day", help="Amount of plays per day, skipped plays excluded")
+
+    success_rate_parser = subparsers.add_parser(
+        "success-rate", help="Portion of submitted scrobbles accepted by scrobbling backends"
+    )
+    success_rate_parser.add_argument(
+        "--backend", help="Name of the scrobbling backend, e.g. last_fm, all backends by default"
+    )
+
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = _parse_args()
+
+    if not os.path.exists(settings.history.path):
+        print(f"No listening history in {settings.history.path}")
+        return
+
+    connection = connect_read_only(settings.history.path)
+    filters = {"player_name": args.player, "since": args.since, "until": args.until}
+
+    try:
+        if args.command == "top-artists":
+            for player_name, artist, plays in top_artists(connection, limit=args.limit, **filters):
+                print(f"{player_name}\t{artist}\t{plays}")
+        elif args.command == "plays-per-day":
+            for day, plays in plays_per_day(connection, **filters):
+                print(f"{day}\t{plays}")
+        elif args.command == "success-rate":
+            success_rate = scrobble_success_rate(connection, backend=args.backend, **filters)
+            print("No scrobbles" if success_rate is None else f"{success_rate:.2%}")
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import time
+from datetime import UTC, datetime, timedelta
+
+from heos_scrobbler.clock import TrackClock
+
+
+def test_track_clock_keeps_earliest_start_estimate() -> None:
+    clock = TrackClock(max_lag_seconds=30)
+
+    clock.start(observed_at=100)
+    assert clock.started_at == 100
+    assert clock.previous_started_at is None
+
+    # Handled 5 seconds late
+    clock.progress(observed_at=115, position=10_000)
+    assert clock.started_at == 100
+
+    # Paused for a minute
+    clock.progress(observed_at=180, position=20_000)
+    # Position is unknown
+    clock.progress(observed_at=181, position=None)
+    assert clock.started_at == 100
+
+    # Boundary was handled late but progress of the new track reveals its start
+    clock.start(observed_at=300)
+    clock.progress(observed_at=301, position=5_000)
+
+    assert clock.previous_started_at == 100
+    assert clock.started_at == 296
+
+
+def test_track_clock_start_with_position() -> None:
+    clock = TrackClock(max_lag_seconds=60)
+
+    clock.start(observed_at=100, position=30_000)
+
+    assert clock.started_at == 70
+
+
+def test_track_clock_start_estimate_is_bounded() -> None:
+    clock = TrackClock(max_lag_seconds=30)
+
+    # Seeked forward by five minutes right after the track change
+    clock.start(observed_at=1000)
+    clock.progress(observed_at=1010, position=300_000)
+    assert clock.started_at == 970
+
+    # Track can't have started before the previous one, e.g. when skipped and then seeked forward
+    clock.start(observed_at=1100)
+    clock.start(observed_at=1110)
+    clock.progress(observed_at=1111, position=60_000)
+    assert clock.started_at == 1100
+
+    # Start of a track whose change was missed is bounded only by the previous track
+    clock.start(observed_at=2000, boundary_observed=False)
+    clock.progress(observed_at=2001, position=600_000)
+    assert clock.started_at == 1401
+
+
+def test_track_clock_to_datetime() -> None:
+    started_at = time.monotonic() - 60
+    expected = datetime.now(UTC) - timedelta(seconds=60)
+
+    scrobbled_at = TrackClock.to_datetime(started_at)
+
+    assert scrobbled_at.tzinfo == UTC
+    assert abs(scrobbled_at - expected) < timedelta(seconds=1)
@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import threading
+import time
+import tracemalloc
+from typing import Iterator
+
+import pytest
+from pytest_mock import MockerFixture
+
+from config import settings
+from heos_scrobbler.diagnostics import (
+    Diagnostics,
+    count_tasks,
+    diff_memory_snapshots,
+    measure_event_loop_lag,
+    sample_thread,
+)
+
+
+@pytest.fixture
+def memory_tracing() -> Iterator[None]:
+    tracemalloc.start()
+    yield
+    tracemalloc.stop()
+
+
+@pytest.mark.asyncio
+async def test_count_tasks() -> None:
+    async def idle() -> None:
+        await asyncio.Event().wait()
+
+    tasks = [asyncio.create_task(idle()) for _ in range(3)]
+    await asyncio.sleep(0)
+
+    assert count_tasks()["test_count_tasks.<locals>.idle"] == 3
+
+    for task in tasks:
+        task.cancel()
+
+
+def test_diff_memory_snapshots(memory_tracing: None) -> None:
+    previous_snapshot = tracemalloc.take_snapshot()
+    leaked = [bytearray(1024) for _ in range(100)]
+    snapshot = tracemalloc.take_snapshot()
+
+    statistics = diff_memory_snapshots(previous_snapshot, snapshot, top=1)
+
+    assert len(leaked) == 100
+    assert statistics[0].traceback[0].filename == __file__
+    assert statistics[0].size_diff >= 100 * 1024
+
+
+def test_sample_thread() -> None:
+    stop_event = threading.Event()
+
+    def busy_loop() -> None:
+        while not stop_event.is_set():
+            pass
+
+    thread = threading.Thread(target=busy_loop)
+    thread.start()
+    assert thread.ident is not None
+
+    timer = threading.Timer(0.2, stop_event.set)
+    timer.start()
+    own_samples, total_samples, samples = sample_thread(thread.ident, 0.005, stop_event)
+    thread.join()
+
+    assert samples > 0
+    busy_loop_function = next(function for function in total_samples if function.startswith("test_sample_thread."))
+    assert total_samples[busy_loop_function] == samples
+    assert sum(own_samples.values()) == samples
+
+
+@pytest.mark.asyncio
+async def test_measure_event_loop_lag() -> None:
+    # Blocking call in the event loop
+    asyncio.get_running_loop().call_later(0.05, time.sleep, 0.1)
+
+    lags = await measure_event_loop_lag(0.3, interval=0.01)
+
+    assert max(lags) >= 0.08
+
+
+@pytest.mark.asyncio
+async def test_diagnostics_dump(mocker: MockerFixture, caplog: pytest.LogCaptureFixture) -> None:
+    mocker.patch.object(settings.diagnostics, "profile_seconds", 0.1)
+    caplog.set_level(logging.INFO, logger="heos_scrobbler.diagnostics")
+    diagnostics = Diagnostics()
+
+    try:
+        diagnostics.trigger()
+        # Second trigger is ignored while diagnostics are running
+        diagnostics.trigger()
+        assert diagnostics._task is not None
+        await diagnostics._task
+
+        assert tracemalloc.is_tracing()
+
+        diagnostics.trigger()
+        await diagnostics._task
+    finally:
+        diagnostics.stop_memory_tracing()
+
+    assert not tracemalloc.is_tracing()
+
+    messages = [record.getMessage() for record in caplog.records]
+    assert "Diagnostics are already running" in messages
+    assert any(message.startswith("Top 15 memory allocation changes") for message in messages)
+    assert any(message.startswith("Event loop lag in ms") for message in messages)
+    assert any(message.startswith("Event loop CPU profile") for message in messages)
+    assert not any(record.levelno >= logging.ERROR for record in caplog.records)
@@ -0,0 +1,153 @@
+import asyncio
+import time
+from types import SimpleNamespace
+from typing import Any, Optional
+
+import pytest
+from dynaconf.base import Settings
+from pyheos import HeosNowPlayingMedia, MediaType
+from pyheos import const as HeosConstants
+from pytest_mock import MockerFixture
+
+from config import settings
+from heos_scrobbler.filters import CompiledScrobbleFilter, ScrobbleFilter
+
+RULES: list[dict[str, Any]] = [
+    {"name": "AUX input", "source_ids": [HeosConstants.MUSIC_SOURCE_AUX_INPUT]},
+    {"name": "Kids room", "players": ["Kids Room"]},
+    {"name": "Podcasts", "album": r"\bpodcasts?\b", "station": r"\bpodcasts?\b"},
+    {"name": "White noise", "artist": "^white noise", "album": "sleep sounds"},
+]
+
+
+def _track(**kwargs: Any) -> HeosNowPlayingMedia:
+    return HeosNowPlayingMedia(
+        **{
+            "type": MediaType.SONG,
+            "artist": "Artist",
+            "album": "Album",
+            "song": "Song",
+            "source_id": HeosConstants.MUSIC_SOURCE_SPOTIFY,
+            **kwargs,
+        }
+    )
+
+
+@pytest.mark.parametrize(
+    "heos_track,player_name,expected",
+    [
+        (_track(), "Living Room", None),
+        (_track(), None, None),
+        (_track(source_id=HeosConstants.MUSIC_SOURCE_AUX_INPUT), "Living Room", "AUX input"),
+        (_track(), "kids room", "Kids room"),
+        (_track(album="The Daily Podcast"), "Living Room", "Podcasts"),
+        (_track(album=None, station="Podcast radio"), "Living Room", "Podcasts"),
+        (_track(album="Podcastic"), "Living Room", None),
+        (_track(artist="White Noise Machine"), "Living Room", "White noise"),
+        (_track(album="Sleep Sounds Vol. 2"), "Living Room", "White noise"),
+        (_track(artist="Not White Noise"), "Living Room", None),
+    ],
+)
+def test_compiled_scrobble_filter_match(
+    heos_track: HeosNowPlayingMedia, player_name: Optional[str], expected: Optional[str]
+) -> None:
+    assert CompiledScrobbleFilter(RULES).match(heos_track, player_name) == expected
+
+
+def test_compiled_scrobble_filter_is_fast() -> None:
+    rules = [*RULES, *[{"name": f"Artist {index}", "artist": f"^artist {index}$"} for index in range(100)]]
+    compiled_filter = CompiledScrobbleFilter(rules)
+    heos_track = _track()
+
+    started_at = time.perf_counter()
+
+    for _ in range(1000):
+        compiled_filter.match(heos_track, "Living Room")
+
+    # Well within microseconds per track, the bound leaves room for slow CI machines
+    assert (time.perf_counter() - started_at) / 1000 < 0.0005
+
+
+@pytest.mark.parametrize("pattern", ["(unclosed", r"(a)\1", r"(?P<a>a)(?P=a)", r"(a)?(?(1)b|c)", r"\\(a)\\\1"])
+def test_compiled_scrobble_filter_validates_patterns(pattern: str) -> None:
+    with pytest.raises(ValueError, match="Broken"):
+        CompiledScrobbleFilter([{"name": "Broken", "artist": pattern}])
+
+
+def test_compiled_scrobble_filter_allows_groups() -> None:
+    # Groups of one rule don't affect the others as long as there are no backreferences
+    compiled_filter = CompiledScrobbleFilter(
+        [
+            {"name": "Podcasts", "album": r"\b(podcast|audiobook)s?\b"},
+            {"name": "Live", "album": r"\\1 \((live)\)"},
+        ]
+    )
+
+    assert compiled_filter.match(_track(album="Audiobooks"), None) == "Podcasts"
+    assert compiled_filter.match(_track(album="\\1 (Live)"), None) == "Live"
+
+
+class TestScrobbleFilter:
+    @pytest.fixture
+    def scrobble_filter(self, mocker: MockerFixture) -> ScrobbleFilter:
+        mocker.patch.object(settings.filters, "rules", RULES)
+
+        return ScrobbleFilter()
+
+    def test_exclude_counts_matches_per_rule(self, scrobble_filter: ScrobbleFilter) -> None:
+        assert scrobble_filter.exclude(_track(source_id=HeosConstants.MUSIC_SOURCE_AUX_INPUT), "Living Room")
+        assert scrobble_filter.exclude(_track(album="Podcast"), "Living Room")
+        assert scrobble_filter.exclude(_track(album="Podcast"), "Living Room")
+        assert not scrobble_filter.exclude(_track(), "Living Room")
+        # Matching without excluding is not counted
+        assert scrobble_filter.match(_track(album="Podcast"), "Living Room") == "Podcasts"
+
+        assert scrobble_filter.match_counts == {"AUX input": 1, "Podcasts": 2}
+
+    def test_reload(self, mocker: MockerFixture, scrobble_filter: ScrobbleFilter) -> None:
+        reload_mock = mocker.patch.object(Settings, "reload", mocker.Mock())
+        scrobble_filter.exclude(_track(album="Podcast"), "Living Room")
+        scrobble_filter.exclude(_track(), "Kids Room")
+
+        mocker.patch(
+            "heos_scrobbler.filters.load_settings",
+            return_value=SimpleNamespace(filters=SimpleNamespace(rules=RULES[1:2])),
+        )
+        scrobble_filter.reload()
+
+        # Other settings are not reloaded
+        reload_mock.assert_not_called()
+        assert scrobble_filter.match(_track(album="Podcast"), "Living Room") is None
+        assert scrobble_filter.match_counts == {"Kids room": 1}
+
+    def test_reload_keeps_previous_rules_on_error(self, mocker: MockerFixture, scrobble_filter: ScrobbleFilter) -> None:
+        mocker.patch(
+            "heos_scrobbler.filters.load_settings",
+            return_value=SimpleNamespace(filters=SimpleNamespace(rules=[{"name": "Broken", "artist": "(unclosed"}])),
+        )
+
+        scrobble_filter.reload()
+
+        assert scrobble_filter.match(_track(album="Podcast"), "Living Room") == "Podcasts"
+
+    @pytest.mark.asyncio
+    async def test_rules_are_reloaded_when_settings_files_change(
+        self, mocker: MockerFixture, scrobble_filter: ScrobbleFilter
+    ) -> None:
+        mocker.patch.object(settings.filters, "reload_interval_seconds", 0.01)
+        reload_mock = mocker.patch.object(scrobble_filter, "reload", mocker.Mock())
+        get_settings_modified_at_mock = mocker.patch.object(
+            scrobble_filter,
+            "_get_settings_modified_at",
+            mocker.Mock(return_value=scrobble_filter._settings_modified_at),
+        )
+
+        scrobble_filter.start()
+        await asyncio.sleep(0.05)
+        reload_mock.assert_not_called()
+
+        get_settings_modified_at_mock.return_value = {"settings.toml": 1.0}
+        await asyncio.sleep(0.05)
+        await scrobble_filter.stop()
+
+        reload_mock.assert_called_once()
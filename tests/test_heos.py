@@ -1,28 +1,51 @@
+import asyncio
 import dataclasses
 import pprint
-from datetime import datetime
+import time
+from datetime import UTC, datetime, timedelta
 from typing import Any, Optional
-from unittest.mock import Mock
+from unittest.mock import AsyncMock, Mock
 
 import pytest
 from faker import Faker
-from pyheos import Heos, HeosNowPlayingMedia, HeosPlayer, LineOutLevelType, MediaType, NetworkType
+from pyheos import (
+    ConnectionState,
+    Heos,
+    HeosError,
+    HeosNowPlayingMedia,
+    HeosPlayer,
+    LineOutLevelType,
+    MediaType,
+    NetworkType,
+    PlayState,
+)
+from pyheos import command as HeosCommand
 from pyheos import const as HeosConstants
+from pyheos.message import HeosMessage
 from pylast import LastFMNetwork
 from pytest_mock import MockerFixture
 
 from config import settings
+from heos_scrobbler.filters import ScrobbleFilter
 from heos_scrobbler.heos import (
+    HeosConnection,
+    HeosConnectionWatchdog,
     HeosDeviceDiscoveryProtocol,
     HeosScrobbler,
+    HeosScrobbling,
     _create_on_heos_player_event_callback,
     _discover_heos_devices,
     initialize_heos_scrobbling,
+    shutdown_heos_scrobbling,
 )
+from heos_scrobbler.history import ListeningHistory, ScrobbleStatus
+from heos_scrobbler.idempotency import ScrobbleIndex
 from heos_scrobbler.last_fm import LastFmScrobbler
+from heos_scrobbler.scrobbling import ScrobblingBackendQueue, ScrobblingBackends
 from tests.util import integration_test
 
 HeosIpsAndPlayers = tuple[list[str | None], list[dict[str, HeosPlayer] | dict[Any, Any]]]
+WatchdogAndHeosMocks = tuple[HeosConnectionWatchdog, AsyncMock, AsyncMock, AsyncMock]
 
 
 @pytest.fixture
@@ -96,20 +119,27 @@ def heos_ips_and_players(faker: Faker, heos: Heos, heos_player: HeosPlayer) -> H
 
 
 @pytest.fixture
-def last_fm_scrobbler(mocker: MockerFixture, last_fm_network: LastFMNetwork) -> LastFmScrobbler:
-    mocker.patch.object(
-        LastFmScrobbler,
-        "_create_last_fm_network",
-        return_value=last_fm_network,
-    )
-    return LastFmScrobbler()
+def scrobbling_backends() -> ScrobblingBackends:
+    return ScrobblingBackends(queues=[])
+
+
+def _submission(exception: Optional[Exception] = None) -> asyncio.Future[None]:
+    # ScrobblingBackends.scrobble returns a future which is done once all scrobbling backends are done
+    submission: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+
+    if exception is None:
+        submission.set_result(None)
+    else:
+        submission.set_exception(exception)
+
+    return submission
 
 
 @pytest.mark.asyncio
 async def test_callback_created_for_heos_player_event_calls_scrobbler(
-    mocker: MockerFixture, heos_player: HeosPlayer, last_fm_scrobbler: LastFmScrobbler
+    mocker: MockerFixture, heos_player: HeosPlayer, scrobbling_backends: ScrobblingBackends
 ) -> None:
-    scrobbler = HeosScrobbler(last_fm_scrobbler=last_fm_scrobbler)
+    scrobbler = HeosScrobbler(scrobbling_backends=scrobbling_backends)
 
     scrobble_mock = mocker.patch.object(scrobbler, "scrobble", mocker.AsyncMock())
     handle_progress_for_track_to_be_scrobbled_mock = mocker.patch.object(
@@ -150,10 +180,27 @@ async def tests_initialize_heos_scrobbling(
     create_on_heos_player_event_callback_mock = mocker.patch(
         "heos_scrobbler.heos._create_on_heos_player_event_callback", mocker.Mock()
     )
+    watchdog_start_mock = mocker.patch.object(HeosConnectionWatchdog, "start", mocker.Mock())
 
-    await initialize_heos_scrobbling()
+    listening_history_start_mock = mocker.patch.object(ListeningHistory, "start", mocker.Mock())
+    scrobbling_backends_start_mock = mocker.patch.object(ScrobblingBackends, "start", mocker.Mock())
+    scrobble_index_open_mock = mocker.patch.object(ScrobbleIndex, "open", mocker.Mock())
+    scrobble_filter_start_mock = mocker.patch.object(ScrobbleFilter, "start", mocker.Mock())
+
+    heos_scrobbling = await initialize_heos_scrobbling()
 
     discover_heos_devices_mock.assert_awaited_once()
+    listening_history_start_mock.assert_called_once()
+    scrobbling_backends_start_mock.assert_called_once()
+    scrobble_index_open_mock.assert_called_once()
+    scrobble_filter_start_mock.assert_called_once()
+    assert [queue.name for queue in heos_scrobbling.scrobbling_backends.queues] == ["last_fm"]
+    # Outcomes of scrobbling backends are recorded to listening history
+    assert heos_scrobbling.scrobbling_backends.listening_history is heos_scrobbling.listening_history
+
+    heos_connections = heos_scrobbling.heos_connections
+    assert len(heos_connections) == 4
+    assert len([connection for connection in heos_connections if connection.heos_scrobbler is not None]) == 2
 
     last_fm_network_mock.assert_called_once()
 
@@ -164,6 +211,7 @@ async def tests_initialize_heos_scrobbling(
     assert heos_get_players_mock.await_count == 4
 
     assert create_on_heos_player_event_callback_mock.call_count == 2
+    assert watchdog_start_mock.call_count == 2
     pprint.pprint(create_on_heos_player_event_callback_mock.call_args_list)
     assert {
         call.kwargs.get("heos_player").__dict__.get("player_id")
@@ -178,7 +226,260 @@ async def tests_initialize_heos_scrobbling(
     }
 
 
+@pytest.mark.asyncio
+async def test_initialize_heos_scrobbling_retries_unreachable_devices(
+    mocker: MockerFixture, heos: Heos, heos_player: HeosPlayer, scrobbling_backends: ScrobblingBackends
+) -> None:
+    mocker.patch.object(settings.heos, "connect_retry_interval_seconds", 0)
+    mocker.patch.object(settings.history, "enabled", False)
+    mocker.patch.object(settings.heos.watchdog, "enabled", False)
+    mocker.patch.object(scrobbling_backends, "start", mocker.Mock())
+    mocker.patch.object(ScrobbleFilter, "start", mocker.Mock())
+    heos_create_and_connect_mock = mocker.patch.object(
+        Heos,
+        "create_and_connect",
+        mocker.AsyncMock(
+            side_effect=[HeosError("Connection timed out"), heos, HeosError("Connection timed out"), heos]
+        ),
+    )
+    mocker.patch.object(heos, "get_players", mocker.AsyncMock(return_value={f"{heos_player.player_id}": heos_player}))
+    unreachable_ip = "192.168.1.2"
+
+    heos_scrobbling = await initialize_heos_scrobbling(
+        heos_device_ips=[unreachable_ip, heos_player.ip_address], scrobbling_backends=scrobbling_backends
+    )
+
+    # Other devices are scrobbled while the unreachable one is retried
+    assert len(heos_scrobbling.heos_connections) == 1
+    assert heos_scrobbling.heos_connections[0].heos_scrobbler is not None
+    assert len(heos_scrobbling.connect_tasks) == 1
+
+    await heos_scrobbling.connect_tasks[0]
+
+    assert len(heos_scrobbling.heos_connections) == 2
+    assert [call.args[0] for call in heos_create_and_connect_mock.call_args_list] == [
+        unreachable_ip,
+        heos_player.ip_address,
+        unreachable_ip,
+        unreachable_ip,
+    ]
+
+
+@pytest.mark.asyncio
+async def test_shutdown_heos_scrobbling(
+    mocker: MockerFixture, heos: Heos, scrobbling_backends: ScrobblingBackends
+) -> None:
+    scrobbler = HeosScrobbler(scrobbling_backends=scrobbling_backends)
+    flush_mock = mocker.patch.object(scrobbler, "flush", mocker.AsyncMock())
+    remove_player_event_callback_mock = mocker.Mock()
+    disconnect_mock = mocker.patch.object(heos, "disconnect", mocker.AsyncMock())
+    watchdog = mocker.Mock(spec=HeosConnectionWatchdog)
+    listening_history = mocker.Mock(spec=ListeningHistory)
+    scrobbling_backends_close_mock = mocker.patch.object(scrobbling_backends, "close", mocker.AsyncMock())
+
+    heos_connections = [
+        HeosConnection(
+            heos=heos,
+            heos_scrobbler=scrobbler,
+            remove_player_event_callback=remove_player_event_callback_mock,
+            watchdog=watchdog,
+        ),
+        HeosConnection(heos=heos),
+    ]
+
+    connect_task = asyncio.create_task(asyncio.Event().wait())
+
+    await shutdown_heos_scrobbling(
+        HeosScrobbling(
+            heos_connections=heos_connections,
+            scrobbling_backends=scrobbling_backends,
+            listening_history=listening_history,
+            connect_tasks=[connect_task],
+        ),
+        timeout=5,
+    )
+
+    assert connect_task.cancelled()
+    watchdog.stop.assert_awaited_once()
+    remove_player_event_callback_mock.assert_called_once()
+    assert heos_connections[0].remove_player_event_callback is None
+    flush_mock.assert_awaited_once_with(timeout=5)
+    scrobbling_backends_close_mock.assert_awaited_once()
+    assert disconnect_mock.await_count == 2
+    listening_history.close.assert_awaited_once()
+
+
+class TestHeosConnectionWatchdog:
+    @pytest.fixture
+    def watchdog_and_heos_mocks(
+        self, mocker: MockerFixture, heos: Heos, heos_player: HeosPlayer, scrobbling_backends: ScrobblingBackends
+    ) -> WatchdogAndHeosMocks:
+        mocker.patch.object(heos, "connection_state", ConnectionState.CONNECTED)
+        disconnect_mock = mocker.patch.object(heos, "disconnect", mocker.AsyncMock())
+        connect_mock = mocker.patch.object(heos, "connect", mocker.AsyncMock())
+        heart_beat_mock = mocker.patch.object(heos, "heart_beat", mocker.AsyncMock())
+
+        watchdog = HeosConnectionWatchdog(
+            heos=heos, heos_player=heos_player, heos_scrobbler=HeosScrobbler(scrobbling_backends=scrobbling_backends)
+        )
+
+        return watchdog, disconnect_mock, connect_mock, heart_beat_mock
+
+    @pytest.mark.asyncio
+    async def test_check_does_nothing_when_events_are_received(
+        self, heos_player: HeosPlayer, watchdog_and_heos_mocks: WatchdogAndHeosMocks
+    ) -> None:
+        watchdog, disconnect_mock, _, heart_beat_mock = watchdog_and_heos_mocks
+        heos_player.state = PlayState.PLAY
+
+        await watchdog.on_player_event(HeosConstants.EVENT_PLAYER_NOW_PLAYING_PROGRESS)
+        await watchdog.check()
+
+        heart_beat_mock.assert_not_awaited()
+        disconnect_mock.assert_not_awaited()
+
+    @pytest.mark.asyncio
+    async def test_check_reconnects_when_no_progress_while_playing(
+        self, heos_player: HeosPlayer, watchdog_and_heos_mocks: WatchdogAndHeosMocks
+    ) -> None:
+        watchdog, disconnect_mock, connect_mock, _ = watchdog_and_heos_mocks
+        heos_player.state = PlayState.PLAY
+        await watchdog.on_player_event(HeosConstants.EVENT_PLAYER_NOW_PLAYING_PROGRESS)
+        watchdog._last_event_at = time.monotonic() - settings.heos.watchdog.progress_timeout_seconds
+
+        await watchdog.check()
+
+        disconnect_mock.assert_awaited_once()
+        connect_mock.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_check_does_not_expect_progress_from_sources_without_it(
+        self, heos_player: HeosPlayer, watchdog_and_heos_mocks: WatchdogAndHeosMocks
+    ) -> None:
+        watchdog, disconnect_mock, _, heart_beat_mock = watchdog_and_heos_mocks
+        heos_player.state = PlayState.PLAY
+        await watchdog.on_player_event(HeosConstants.EVENT_PLAYER_NOW_PLAYING_PROGRESS)
+        # E.g. switched to AUX input
+        await watchdog.on_player_event(HeosConstants.EVENT_PLAYER_NOW_PLAYING_CHANGED)
+        watchdog._last_event_at = time.monotonic() - settings.heos.watchdog.progress_timeout_seconds
+
+        await watchdog.check()
+
+        disconnect_mock.assert_not_awaited()
+        heart_beat_mock.assert_not_awaited()
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize(
+        "heart_beat_side_effect,expect_reconnect",
+        [
+            (None, False),
+            (HeosError(), True),
+            (TimeoutError(), True),
+        ],
+    )
+    async def test_check_sends_heart_beat_when_idle(
+        self,
+        heos_player: HeosPlayer,
+        watchdog_and_heos_mocks: WatchdogAndHeosMocks,
+        heart_beat_side_effect: Optional[Exception],
+        expect_reconnect: bool,
+    ) -> None:
+        watchdog, _, connect_mock, heart_beat_mock = watchdog_and_heos_mocks
+        heos_player.state = PlayState.PAUSE
+        heart_beat_mock.side_effect = heart_beat_side_effect
+        watchdog._last_event_at = watchdog._last_alive_at = (
+            time.monotonic() - settings.heos.watchdog.heart_beat_interval_seconds
+        )
+
+        await watchdog.check()
+
+        heart_beat_mock.assert_awaited_once()
+        assert connect_mock.await_count == int(expect_reconnect)
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize(
+        "connection_state,expect_reconnect",
+        [
+            (ConnectionState.RECONNECTING, False),
+            (ConnectionState.DISCONNECTED, True),
+        ],
+    )
+    async def test_check_when_not_connected(
+        self,
+        mocker: MockerFixture,
+        heos: Heos,
+        watchdog_and_heos_mocks: WatchdogAndHeosMocks,
+        connection_state: ConnectionState,
+        expect_reconnect: bool,
+    ) -> None:
+        watchdog, _, connect_mock, _ = watchdog_and_heos_mocks
+        mocker.patch.object(heos, "connection_state", connection_state)
+
+        await watchdog.check()
+
+        assert connect_mock.await_count == int(expect_reconnect)
+
+    @pytest.mark.asyncio
+    async def test_on_connected_resyncs_scrobbler(
+        self,
+        mocker: MockerFixture,
+        heos: Heos,
+        heos_player: HeosPlayer,
+        heos_now_playing_media: HeosNowPlayingMedia,
+        watchdog_and_heos_mocks: WatchdogAndHeosMocks,
+    ) -> None:
+        mocker.patch.object(settings.now_playing, "settle_delay_seconds", 0)
+        watchdog = watchdog_and_heos_mocks[0]
+        scrobbler = watchdog.heos_scrobbler
+        scrobble_mock = mocker.patch.object(
+            scrobbler.scrobbling_backends, "scrobble", mocker.Mock(return_value=_submission())
+        )
+        update_now_playing_mock = mocker.patch.object(
+            scrobbler.scrobbling_backends, "update_now_playing", mocker.Mock()
+        )
+        scrobbler.handle_progress_for_track_to_be_scrobbled(heos_now_playing_media)
+        song = heos_now_playing_media.song
+
+        async def get_now_playing_media(player_id: int, update: HeosNowPlayingMedia) -> HeosNowPlayingMedia:
+            # Track changed while disconnected, refreshing clears progress as with a real HEOS device
+            update._update_from_message(
+                HeosMessage(
+                    command=HeosCommand.COMMAND_GET_NOW_PLAYING_MEDIA,
+                    payload={"type": "song", "song": "Next", "artist": "Artist", "album": "Album", "mid": "next"},
+                )
+            )
+            return update
+
+        mocker.patch.object(heos, "get_now_playing_media", side_effect=get_now_playing_media)
+
+        await watchdog.on_connected()
+        await asyncio.gather(*scrobbler._pending_scrobbles)
+
+        assert heos_player.now_playing_media.current_position is None
+        assert scrobbler.heos_track_for_scrobbling.value.media_id == "next"
+        scrobble_mock.assert_called_once()
+        assert scrobble_mock.call_args.kwargs["track"] == song
+        update_now_playing_mock.assert_not_called()
+
+        # Next progress event reconciles now playing
+        heos_player.now_playing_media.current_position = 1_000
+        heos_player.now_playing_media.duration = 180_000
+        callback = _create_on_heos_player_event_callback(heos_player=heos_player, heos_scrobbler=scrobbler)
+        await callback(HeosConstants.EVENT_PLAYER_NOW_PLAYING_PROGRESS)
+        assert scrobbler._now_playing_task is not None
+        await scrobbler._now_playing_task
+
+        update_now_playing_mock.assert_called_once()
+        assert update_now_playing_mock.call_args.kwargs["track"] == "Next"
+        assert scrobbler.heos_track_for_scrobbling.value.duration == 180_000
+
+
 class TestHeosScrobbler:
+    @pytest.fixture(autouse=True)
+    def now_playing_settings(self, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings.now_playing, "settle_delay_seconds", 0)
+        mocker.patch.object(settings.now_playing, "refresh_interval_seconds", 0)
+
     @pytest.mark.parametrize(
         "media_type,duration,expected",
         [
@@ -212,37 +513,296 @@ class TestHeosScrobbler:
         assert HeosScrobbler.can_scrobble_track(media) == expected
 
     @pytest.mark.asyncio
-    async def test_scrobble_calls_lastfm_scrobbler(
-        self, mocker: MockerFixture, last_fm_scrobbler: LastFmScrobbler, heos_now_playing_media: HeosNowPlayingMedia
+    async def test_scrobble_calls_scrobbling_backends(
+        self,
+        mocker: MockerFixture,
+        scrobbling_backends: ScrobblingBackends,
+        heos_now_playing_media: HeosNowPlayingMedia,
     ) -> None:
-        scrobble_sync_mock = mocker.patch.object(last_fm_scrobbler, "_scrobble_sync", mocker.Mock())
+        scrobble_mock = mocker.patch.object(scrobbling_backends, "scrobble", mocker.Mock(return_value=_submission()))
 
-        scrobbler = HeosScrobbler(last_fm_scrobbler=last_fm_scrobbler)
+        scrobbler = HeosScrobbler(scrobbling_backends=scrobbling_backends)
 
-        scrobbler.handle_progress_for_track_to_be_scrobbled(heos_now_playing_media)
+        assert heos_now_playing_media.current_position is not None
+        observed_at = time.monotonic()
+        scrobbler.handle_progress_for_track_to_be_scrobbled(heos_now_playing_media, observed_at=observed_at)
+        started_at = datetime.now(UTC) - timedelta(milliseconds=heos_now_playing_media.current_position)
+
+        await scrobbler.scrobble(
+            heos_track=dataclasses.replace(heos_now_playing_media, media_id="abc"), observed_at=observed_at + 60
+        )
 
-        now = datetime.now()
+        scrobble_mock.assert_called_once_with(
+            artist=heos_now_playing_media.artist,
+            track=heos_now_playing_media.song,
+            scrobbled_at=mocker.ANY,
+            album=heos_now_playing_media.album,
+            player_id=None,
+            player_name=None,
+        )
+        # Scrobble is timestamped with the start of the track instead of the time the next one started
+        scrobbled_at = scrobble_mock.call_args.kwargs["scrobbled_at"]
+        assert scrobbled_at.tzinfo == UTC
+        assert abs(scrobbled_at - started_at) < timedelta(seconds=1)
+
+    @pytest.mark.asyncio
+    async def test_scrobble_timestamp_is_not_shifted_by_event_backlog(
+        self,
+        mocker: MockerFixture,
+        scrobbling_backends: ScrobblingBackends,
+        heos_now_playing_media: HeosNowPlayingMedia,
+    ) -> None:
+        scrobble_mock = mocker.patch.object(scrobbling_backends, "scrobble", mocker.Mock(return_value=_submission()))
+
+        scrobbler = HeosScrobbler(scrobbling_backends=scrobbling_backends)
+        heos_track = dataclasses.replace(heos_now_playing_media, duration=180_000, current_position=None)
+        started_at = time.monotonic() - 200
+
+        # Track change and progress events of the first 20 seconds were handled late, all at once
+        await scrobbler.scrobble(heos_track=heos_track, observed_at=started_at + 20)
+        for position in range(1, 21):
+            scrobbler.handle_progress_for_track_to_be_scrobbled(
+                dataclasses.replace(heos_track, current_position=position * 1000),
+                observed_at=started_at + 20,
+            )
+        scrobbler.handle_progress_for_track_to_be_scrobbled(
+            dataclasses.replace(heos_track, current_position=170_000), observed_at=started_at + 175
+        )
 
         await scrobbler.scrobble(
-            heos_track=dataclasses.replace(heos_now_playing_media, media_id="abc"), scrobbled_at=now
+            heos_track=dataclasses.replace(heos_track, media_id="abc"), observed_at=started_at + 190
+        )
+
+        scrobbled_at = scrobble_mock.call_args.kwargs["scrobbled_at"]
+        assert abs(scrobbled_at - (datetime.now(UTC) - timedelta(seconds=200))) < timedelta(seconds=1)
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize(
+        "listened_portion,scrobble_side_effect,expected_status",
+        [
+            (settings.scrobble_length_min_portion, None, ScrobbleStatus.SUBMITTED),
+            (settings.scrobble_length_min_portion / 2, None, ScrobbleStatus.SKIPPED),
+            # Outcomes of scrobbling backends are recorded by them
+            (settings.scrobble_length_min_portion, RuntimeError(), ScrobbleStatus.SUBMITTED),
+        ],
+    )
+    async def test_scrobble_records_play_to_listening_history(
+        self,
+        mocker: MockerFixture,
+        scrobbling_backends: ScrobblingBackends,
+        heos_player: HeosPlayer,
+        heos_now_playing_media: HeosNowPlayingMedia,
+        listened_portion: float,
+        scrobble_side_effect: Optional[Exception],
+        expected_status: ScrobbleStatus,
+    ) -> None:
+        mocker.patch.object(
+            scrobbling_backends, "scrobble", mocker.Mock(return_value=_submission(exception=scrobble_side_effect))
         )
+        listening_history = mocker.Mock(spec=ListeningHistory)
 
-        scrobble_sync_mock.assert_called_with(
-            heos_now_playing_media.artist,
-            heos_now_playing_media.song,
-            now,
-            heos_now_playing_media.album,
+        scrobbler = HeosScrobbler(
+            scrobbling_backends=scrobbling_backends, listening_history=listening_history, heos_player=heos_player
         )
 
-    def test_update_now_playing_calls_lastfm_scrobbler(
-        self, mocker: MockerFixture, last_fm_scrobbler: LastFmScrobbler, heos_now_playing_media: HeosNowPlayingMedia
+        assert heos_now_playing_media.duration is not None
+        scrobbler.handle_progress_for_track_to_be_scrobbled(
+            dataclasses.replace(
+                heos_now_playing_media, current_position=int(heos_now_playing_media.duration * listened_portion)
+            )
+        )
+
+        started_at = datetime.now(UTC) - timedelta(milliseconds=int(heos_now_playing_media.duration * listened_portion))
+        next_track = dataclasses.replace(heos_now_playing_media, media_id="abc")
+
+        await scrobbler.scrobble(heos_track=next_track)
+
+        listening_history.record.assert_called_once()
+        play = listening_history.record.call_args.args[0]
+        assert play.status == expected_status
+        assert abs(play.played_at - started_at) < timedelta(seconds=1)
+        assert play.player_name == heos_player.name
+        assert play.track == heos_now_playing_media.song
+
+    @pytest.mark.asyncio
+    async def test_excluded_tracks_are_not_scrobbled(
+        self,
+        mocker: MockerFixture,
+        scrobbling_backends: ScrobblingBackends,
+        heos_player: HeosPlayer,
+        heos_now_playing_media: HeosNowPlayingMedia,
     ) -> None:
-        update_now_playing_mock = mocker.patch.object(last_fm_scrobbler, "update_now_playing", mocker.Mock())
+        scrobble_mock = mocker.patch.object(scrobbling_backends, "scrobble", mocker.Mock(return_value=_submission()))
+        update_now_playing_mock = mocker.patch.object(scrobbling_backends, "update_now_playing", mocker.Mock())
+        mocker.patch.object(settings.filters, "rules", [{"name": "Room", "players": [heos_player.name]}])
+        scrobble_filter = ScrobbleFilter()
+        listening_history = mocker.Mock(spec=ListeningHistory)
+
+        scrobbler = HeosScrobbler(
+            scrobbling_backends=scrobbling_backends,
+            listening_history=listening_history,
+            heos_player=heos_player,
+            scrobble_filter=scrobble_filter,
+        )
+        scrobbler.handle_progress_for_track_to_be_scrobbled(heos_now_playing_media)
+        scrobbler.update_now_playing(heos_now_playing_media)
+        assert scrobbler._now_playing_task is not None
+        await scrobbler._now_playing_task
 
-        scrobbler = HeosScrobbler(last_fm_scrobbler=last_fm_scrobbler)
+        await scrobbler.scrobble(heos_track=dataclasses.replace(heos_now_playing_media, media_id="abc"))
+
+        scrobble_mock.assert_not_called()
+        update_now_playing_mock.assert_not_called()
+        assert listening_history.record.call_args.args[0].status == ScrobbleStatus.SKIPPED
+        assert scrobble_filter.match_counts == {"Room": 1}
+
+    @pytest.mark.asyncio
+    async def test_tracks_without_metadata_are_neither_scrobbled_nor_recorded(
+        self,
+        mocker: MockerFixture,
+        scrobbling_backends: ScrobblingBackends,
+        heos_now_playing_media: HeosNowPlayingMedia,
+    ) -> None:
+        listening_history = mocker.Mock(spec=ListeningHistory)
+        queue = mocker.Mock(spec=ScrobblingBackendQueue)
+        scrobbling_backends.queues.append(queue)
+
+        scrobbler = HeosScrobbler(scrobbling_backends=scrobbling_backends, listening_history=listening_history)
+        scrobbler.handle_progress_for_track_to_be_scrobbled(dataclasses.replace(heos_now_playing_media, song=""))
+
+        await scrobbler.scrobble(heos_track=dataclasses.replace(heos_now_playing_media, media_id="abc"))
+
+        queue.scrobble.assert_not_called()
+        listening_history.record.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_flush_waits_pending_scrobbles(
+        self,
+        mocker: MockerFixture,
+        scrobbling_backends: ScrobblingBackends,
+        heos_now_playing_media: HeosNowPlayingMedia,
+    ) -> None:
+        scrobble_started = asyncio.Event()
+        submission: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+
+        def slow_scrobble(**kwargs: Any) -> asyncio.Future[None]:
+            scrobble_started.set()
+            return submission
+
+        scrobble_mock = mocker.patch.object(scrobbling_backends, "scrobble", mocker.Mock(side_effect=slow_scrobble))
+
+        scrobbler = HeosScrobbler(scrobbling_backends=scrobbling_backends)
+        scrobbler.handle_progress_for_track_to_be_scrobbled(heos_now_playing_media)
 
+        callback_task = asyncio.create_task(
+            scrobbler.scrobble(heos_track=dataclasses.replace(heos_now_playing_media, media_id="abc"))
+        )
+        await scrobble_started.wait()
+
+        # Cancelling the event callback must not cancel the scrobble itself
+        callback_task.cancel()
+        submission.set_result(None)
+
+        await scrobbler.flush(timeout=5)
+
+        scrobble_mock.assert_called_once()
+        assert not scrobbler._pending_scrobbles
+
+    @pytest.mark.asyncio
+    async def test_flush_cancels_scrobbles_exceeding_timeout(
+        self,
+        mocker: MockerFixture,
+        scrobbling_backends: ScrobblingBackends,
+        heos_now_playing_media: HeosNowPlayingMedia,
+    ) -> None:
+        scrobble_started = asyncio.Event()
+
+        def hanging_scrobble(**kwargs: Any) -> asyncio.Future[None]:
+            scrobble_started.set()
+            return asyncio.get_running_loop().create_future()
+
+        mocker.patch.object(scrobbling_backends, "scrobble", mocker.Mock(side_effect=hanging_scrobble))
+
+        scrobbler = HeosScrobbler(scrobbling_backends=scrobbling_backends)
+        scrobbler.handle_progress_for_track_to_be_scrobbled(heos_now_playing_media)
+
+        callback_task = asyncio.create_task(
+            scrobbler.scrobble(heos_track=dataclasses.replace(heos_now_playing_media, media_id="abc"))
+        )
+        await scrobble_started.wait()
+
+        pending_scrobbles = set(scrobbler._pending_scrobbles)
+
+        await scrobbler.flush(timeout=0.01)
+
+        with pytest.raises(asyncio.CancelledError):
+            await callback_task
+
+        assert all(task.cancelled() for task in pending_scrobbles)
+
+    @pytest.mark.asyncio
+    async def test_resync_scrobbles_when_track_change_was_missed(
+        self,
+        mocker: MockerFixture,
+        scrobbling_backends: ScrobblingBackends,
+        heos_now_playing_media: HeosNowPlayingMedia,
+    ) -> None:
+        scrobble_mock = mocker.patch.object(scrobbling_backends, "scrobble", mocker.Mock(return_value=_submission()))
+        update_now_playing_mock = mocker.patch.object(scrobbling_backends, "update_now_playing", mocker.Mock())
+
+        scrobbler = HeosScrobbler(scrobbling_backends=scrobbling_backends)
+        scrobbler.handle_progress_for_track_to_be_scrobbled(heos_now_playing_media)
+
+        # Refreshed media has no progress
+        next_track = dataclasses.replace(
+            heos_now_playing_media, media_id="abc", song="Next", current_position=None, duration=None
+        )
+        scrobbler.resync(next_track)
+        await scrobbler.flush(timeout=5)
+
+        assert scrobbler.heos_track_for_scrobbling.value.media_id == "abc"
+        scrobble_mock.assert_called_once()
+        assert scrobble_mock.call_args.kwargs["track"] == heos_now_playing_media.song
+        # Now playing is updated by the next progress event once duration is known
+        update_now_playing_mock.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_resync_keeps_progress_of_same_track(
+        self,
+        mocker: MockerFixture,
+        scrobbling_backends: ScrobblingBackends,
+        heos_now_playing_media: HeosNowPlayingMedia,
+    ) -> None:
+        scrobble_mock = mocker.patch.object(scrobbling_backends, "scrobble", mocker.Mock(return_value=_submission()))
+        mocker.patch.object(scrobbling_backends, "update_now_playing", mocker.Mock())
+
+        scrobbler = HeosScrobbler(scrobbling_backends=scrobbling_backends)
+        scrobbler.handle_progress_for_track_to_be_scrobbled(heos_now_playing_media)
+
+        scrobbler.resync(dataclasses.replace(heos_now_playing_media, current_position=None, duration=None))
+
+        assert scrobbler.heos_track_for_scrobbling.value.current_position == heos_now_playing_media.current_position
+        assert scrobbler.heos_track_for_scrobbling.value.duration == heos_now_playing_media.duration
+        scrobble_mock.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_update_now_playing_calls_scrobbling_backends(
+        self,
+        mocker: MockerFixture,
+        scrobbling_backends: ScrobblingBackends,
+        heos_now_playing_media: HeosNowPlayingMedia,
+    ) -> None:
+        update_now_playing_mock = mocker.patch.object(scrobbling_backends, "update_now_playing", mocker.Mock())
+
+        scrobbler = HeosScrobbler(scrobbling_backends=scrobbling_backends)
+
+        scrobbler.update_now_playing(heos_track=heos_now_playing_media)
+        # Progress events of the same track don't trigger new updates
         scrobbler.update_now_playing(heos_track=heos_now_playing_media)
 
+        assert scrobbler._now_playing_task is not None
+        await scrobbler._now_playing_task
+
         assert heos_now_playing_media.duration is not None
 
         update_now_playing_mock.assert_called_once_with(
@@ -252,6 +812,119 @@ class TestHeosScrobbler:
             album=heos_now_playing_media.album,
         )
 
+    @pytest.mark.asyncio
+    async def test_update_now_playing_is_not_sent_for_skipped_tracks(
+        self,
+        mocker: MockerFixture,
+        scrobbling_backends: ScrobblingBackends,
+        heos_now_playing_media: HeosNowPlayingMedia,
+    ) -> None:
+        mocker.patch.object(settings.now_playing, "settle_delay_seconds", 0.05)
+        update_now_playing_mock = mocker.patch.object(scrobbling_backends, "update_now_playing", mocker.Mock())
+        mocker.patch.object(scrobbling_backends, "scrobble", mocker.Mock(return_value=_submission()))
+
+        scrobbler = HeosScrobbler(scrobbling_backends=scrobbling_backends)
+
+        scrobbler.update_now_playing(heos_track=dataclasses.replace(heos_now_playing_media, media_id="skipped"))
+        scrobbler.update_now_playing(heos_track=heos_now_playing_media)
+        skipped_task = scrobbler._now_playing_task
+        # Track changed before its duration was known
+        await scrobbler.scrobble(heos_track=dataclasses.replace(heos_now_playing_media, media_id="next", duration=0))
+
+        await asyncio.sleep(0.1)
+
+        assert skipped_task is not None and skipped_task.cancelled()
+        update_now_playing_mock.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_update_now_playing_is_refreshed_for_long_tracks(
+        self,
+        mocker: MockerFixture,
+        scrobbling_backends: ScrobblingBackends,
+        heos_now_playing_media: HeosNowPlayingMedia,
+    ) -> None:
+        mocker.patch.object(settings.now_playing, "refresh_interval_seconds", 240)
+        sleep_mock = mocker.patch.object(asyncio, "sleep", mocker.AsyncMock())
+        update_now_playing_mock = mocker.patch.object(scrobbling_backends, "update_now_playing", mocker.Mock())
+
+        scrobbler = HeosScrobbler(scrobbling_backends=scrobbling_backends)
+        scrobbler.update_now_playing(
+            heos_track=dataclasses.replace(heos_now_playing_media, duration=1_000_000, current_position=100_000)
+        )
+
+        assert scrobbler._now_playing_task is not None
+        await scrobbler._now_playing_task
+
+        # 900 seconds remaining
+        assert update_now_playing_mock.call_count == 4
+        assert [call.args[0] for call in sleep_mock.await_args_list] == [0, 240, 240, 240]
+
+    @pytest.mark.asyncio
+    async def test_update_now_playing_is_not_refreshed_after_pause(
+        self,
+        mocker: MockerFixture,
+        scrobbling_backends: ScrobblingBackends,
+        heos_player: HeosPlayer,
+        heos_now_playing_media: HeosNowPlayingMedia,
+    ) -> None:
+        mocker.patch.object(settings.now_playing, "refresh_interval_seconds", 240)
+        heos_player.state = PlayState.PLAY
+
+        async def pause_mid_track(delay: float) -> None:
+            if delay == 240:
+                heos_player.state = PlayState.PAUSE
+
+        mocker.patch.object(asyncio, "sleep", mocker.AsyncMock(side_effect=pause_mid_track))
+        update_now_playing_mock = mocker.patch.object(scrobbling_backends, "update_now_playing", mocker.Mock())
+
+        scrobbler = HeosScrobbler(scrobbling_backends=scrobbling_backends, heos_player=heos_player)
+        scrobbler.update_now_playing(
+            heos_track=dataclasses.replace(heos_now_playing_media, duration=1_000_000, current_position=100_000)
+        )
+
+        assert scrobbler._now_playing_task is not None
+        await scrobbler._now_playing_task
+
+        update_now_playing_mock.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_pause_cancels_now_playing_until_playback_resumes(
+        self,
+        mocker: MockerFixture,
+        scrobbling_backends: ScrobblingBackends,
+        heos_player: HeosPlayer,
+        heos_now_playing_media: HeosNowPlayingMedia,
+    ) -> None:
+        mocker.patch.object(settings.now_playing, "refresh_interval_seconds", 240)
+        update_now_playing_mock = mocker.patch.object(scrobbling_backends, "update_now_playing", mocker.Mock())
+        scrobbler = HeosScrobbler(scrobbling_backends=scrobbling_backends, heos_player=heos_player)
+        callback = _create_on_heos_player_event_callback(heos_player=heos_player, heos_scrobbler=scrobbler)
+        heos_player.state = PlayState.PLAY
+        heos_player.now_playing_media.duration = 1_000_000
+        heos_player.now_playing_media.current_position = 100_000
+
+        await callback(HeosConstants.EVENT_PLAYER_NOW_PLAYING_PROGRESS)
+        now_playing_task = scrobbler._now_playing_task
+        assert now_playing_task is not None
+        await asyncio.sleep(0.01)
+        update_now_playing_mock.assert_called_once()
+
+        heos_player.state = PlayState.PAUSE
+        await callback(HeosConstants.EVENT_PLAYER_STATE_CHANGED)
+
+        assert scrobbler._now_playing_task is None
+        await asyncio.sleep(0.01)
+        assert now_playing_task.cancelled()
+
+        heos_player.state = PlayState.PLAY
+        await callback(HeosConstants.EVENT_PLAYER_STATE_CHANGED)
+        await callback(HeosConstants.EVENT_PLAYER_NOW_PLAYING_PROGRESS)
+        assert scrobbler._now_playing_task is not None
+        await asyncio.sleep(0.01)
+
+        assert update_now_playing_mock.call_count == 2
+        scrobbler._cancel_now_playing()
+
 
 @integration_test
 @pytest.mark.asyncio
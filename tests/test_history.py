@@ -0,0 +1,164 @@
+import sqlite3
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Optional
+
+import pytest
+from faker import Faker
+
+from heos_scrobbler.history import (
+    ListeningHistory,
+    Play,
+    ScrobbleResult,
+    ScrobbleStatus,
+    connect,
+    connect_read_only,
+    plays_per_day,
+    scrobble_success_rate,
+    top_artists,
+)
+
+
+@pytest.fixture
+def database_path(tmp_path: Path) -> str:
+    return str(tmp_path / "history.sqlite3")
+
+
+def _play(
+    faker: Faker,
+    artist: str,
+    played_at: datetime,
+    player_name: str = "Living Room",
+    status: ScrobbleStatus = ScrobbleStatus.SUBMITTED,
+) -> Play:
+    return Play(
+        played_at=played_at,
+        player_id=faker.random_int(),
+        player_name=player_name,
+        artist=artist,
+        track=faker.name(),
+        album=faker.name(),
+        duration=180_000,
+        position=170_000,
+        status=status,
+    )
+
+
+def _scrobble(play: Play, backend: str, status: ScrobbleStatus = ScrobbleStatus.SCROBBLED) -> ScrobbleResult:
+    return ScrobbleResult(
+        scrobbled_at=play.played_at,
+        player_id=play.player_id,
+        player_name=play.player_name,
+        artist=play.artist,
+        track=play.track,
+        backend=backend,
+        status=status,
+    )
+
+
+@pytest.fixture
+def connection(faker: Faker, database_path: str) -> sqlite3.Connection:
+    connection = connect(database_path)
+    day = datetime(2025, 6, 1, 12)
+    plays = [
+        _play(faker, "A", day),
+        _play(faker, "A", day),
+        _play(faker, "B", day + timedelta(days=1)),
+        _play(faker, "C", day + timedelta(days=1), player_name="Kitchen"),
+        _play(faker, "C", day + timedelta(days=1), player_name="Kitchen"),
+        _play(faker, "D", day + timedelta(days=2), player_name="Kitchen", status=ScrobbleStatus.SKIPPED),
+    ]
+    scrobbles = [
+        *[_scrobble(play, "last_fm") for play in plays[:4]],
+        _scrobble(plays[4], "last_fm", status=ScrobbleStatus.FAILED),
+        *[_scrobble(play, "listenbrainz") for play in [plays[0], plays[1], plays[3]]],
+        *[_scrobble(play, "listenbrainz", status=ScrobbleStatus.FAILED) for play in [plays[2], plays[4]]],
+    ]
+
+    history = ListeningHistory(path=database_path, batch_size=100)
+    history._connection = connection
+    history._write_sync([*plays, *scrobbles])
+
+    return connection
+
+
+@pytest.mark.asyncio
+async def test_listening_history_writes_recorded_plays_in_batches(faker: Faker, database_path: str) -> None:
+    history = ListeningHistory(path=database_path, batch_size=2)
+    history.start()
+
+    for _ in range(5):
+        play = _play(faker, faker.name(), datetime.now())
+        history.record(play)
+        history.record_scrobble(_scrobble(play, "last_fm"))
+
+    await history.close()
+
+    connection = sqlite3.connect(database_path)
+    assert connection.execute("SELECT COUNT(*) FROM plays").fetchone() == (5,)
+    assert connection.execute("SELECT SUM(plays) FROM daily_plays").fetchone() == (5,)
+    assert connection.execute("SELECT COUNT(*) FROM scrobbles").fetchone() == (5,)
+    assert connection.execute("SELECT SUM(scrobbles) FROM daily_scrobbles").fetchone() == (5,)
+
+
+@pytest.mark.parametrize(
+    "condition,index",
+    [
+        ("played_at >= ?", "plays_played_at"),
+        ("player_name = 'Kitchen' AND played_at >= ?", "plays_player_name_played_at"),
+    ],
+)
+def test_plays_are_indexed_by_time_and_player(connection: sqlite3.Connection, condition: str, index: str) -> None:
+    plan = connection.execute(f"EXPLAIN QUERY PLAN SELECT * FROM plays WHERE {condition}", [0]).fetchall()
+
+    assert index in str(plan)
+
+
+def test_connect_read_only(database_path: str, connection: sqlite3.Connection) -> None:
+    read_only_connection = connect_read_only(database_path)
+
+    assert plays_per_day(read_only_connection) == plays_per_day(connection)
+
+    with pytest.raises(sqlite3.OperationalError):
+        read_only_connection.execute("DELETE FROM plays")
+
+    with pytest.raises(sqlite3.OperationalError):
+        connect_read_only(str(Path(database_path).with_name("missing.sqlite3"))).execute("SELECT 1")
+
+    assert not Path(database_path).with_name("missing.sqlite3").exists()
+
+
+def test_top_artists(connection: sqlite3.Connection) -> None:
+    assert top_artists(connection, limit=1) == [("Kitchen", "C", 2), ("Living Room", "A", 2)]
+    assert top_artists(connection, limit=10, player_name="Living Room") == [
+        ("Living Room", "A", 2),
+        ("Living Room", "B", 1),
+    ]
+    assert top_artists(connection, limit=10, since=date(2025, 6, 2)) == [("Kitchen", "C", 2), ("Living Room", "B", 1)]
+    assert top_artists(connection, limit=10, until=date(2025, 6, 2)) == [("Living Room", "A", 2)]
+
+
+def test_plays_per_day(connection: sqlite3.Connection) -> None:
+    assert plays_per_day(connection) == [("2025-06-01", 2), ("2025-06-02", 3)]
+    assert plays_per_day(connection, since=date(2025, 6, 2)) == [("2025-06-02", 3)]
+    assert plays_per_day(connection, player_name="Kitchen") == [("2025-06-02", 2)]
+
+
+@pytest.mark.parametrize(
+    "player_name,until,backend,expected",
+    [
+        (None, None, None, 7 / 10),
+        (None, None, "last_fm", 4 / 5),
+        (None, None, "listenbrainz", 3 / 5),
+        ("Kitchen", None, None, 1 / 2),
+        (None, date(2025, 1, 1), None, None),
+    ],
+)
+def test_scrobble_success_rate(
+    connection: sqlite3.Connection,
+    player_name: Optional[str],
+    until: Optional[date],
+    backend: Optional[str],
+    expected: Optional[float],
+) -> None:
+    assert scrobble_success_rate(connection, player_name=player_name, until=until, backend=backend) == expected
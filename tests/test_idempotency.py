@@ -0,0 +1,97 @@
+from pathlib import Path
+
+import pytest
+
+from heos_scrobbler.idempotency import ScrobbleIndex, create_idempotency_key
+
+
+@pytest.fixture
+def index_path(tmp_path: Path) -> str:
+    return str(tmp_path / "scrobble_index.bin")
+
+
+def test_create_idempotency_key() -> None:
+    key = create_idempotency_key(
+        backend="last_fm", player_id=1, artist="Artist", track="Track", started_at_timestamp=1_700_000_000
+    )
+
+    assert key == create_idempotency_key(
+        backend="last_fm", player_id=1, artist="ARTIST", track="track", started_at_timestamp=1_700_000_000
+    )
+    assert key != create_idempotency_key(
+        backend="listenbrainz", player_id=1, artist="Artist", track="Track", started_at_timestamp=1_700_000_000
+    )
+    assert key != create_idempotency_key(
+        backend="last_fm", player_id=2, artist="Artist", track="Track", started_at_timestamp=1_700_000_000
+    )
+    assert key != create_idempotency_key(
+        backend="last_fm", player_id=1, artist="Artist", track="Track", started_at_timestamp=1_700_000_001
+    )
+    # Lowest bit is reserved for the state of the submission
+    assert key % 2 == 0
+
+
+def test_scrobble_index_persists_keys(index_path: str) -> None:
+    index = ScrobbleIndex(path=index_path, capacity=100)
+    index.open()
+    index.add_pending(2)
+    index.acknowledge(2)
+    index.add_pending(4)
+    index.add_pending(4)
+    index.close()
+
+    # Partially written key of a crashed process is ignored
+    with open(index_path, "ab") as file:
+        file.write(b"\x00\x01")
+
+    index = ScrobbleIndex(path=index_path, capacity=100)
+    index.open()
+
+    assert 2 in index and index.is_acknowledged(2)
+    # Crashed before the backend acknowledged the submission
+    assert 4 in index and not index.is_acknowledged(4)
+    assert 6 not in index
+    assert len(index) == 2
+
+    # Pending key is not added again and acknowledged key does not go back to pending
+    index.add_pending(2)
+    index.acknowledge(4)
+    index.close()
+
+    index = ScrobbleIndex(path=index_path, capacity=100)
+    index.open()
+
+    assert index.is_acknowledged(2) and index.is_acknowledged(4)
+
+    index.close()
+
+
+def test_scrobble_index_is_bounded(index_path: str) -> None:
+    index = ScrobbleIndex(path=index_path, capacity=10)
+    index.open()
+
+    for key in range(0, 200, 2):
+        index.add_pending(key)
+        index.acknowledge(key)
+
+    assert len(index) <= 10
+    # Latest half of capacity is always remembered
+    assert all(index.is_acknowledged(key) for key in range(190, 200, 2))
+    assert 0 not in index
+
+    index.close()
+
+    # Pending and acknowledged records of each key
+    assert Path(index_path).stat().st_size <= 2 * 10 * 8
+
+    index = ScrobbleIndex(path=index_path, capacity=10)
+    index.open()
+
+    assert all(index.is_acknowledged(key) for key in range(190, 200, 2))
+
+    index.close()
+
+
+def test_scrobble_index_must_be_opened(index_path: str) -> None:
+    with pytest.raises(RuntimeError):
+        ScrobbleIndex(path=index_path, capacity=10).add_pending(2)
@@ -3,35 +3,39 @@ from typing import Optional, Type, Union
 
 import pytest
 from pydantic import ValidationError
-from pylast import LastFMNetwork, NetworkError, WSError
+from pylast import LastFMNetwork, NetworkError, PlayedTrack, Track, User, WSError
 from pytest_mock import MockerFixture
 
 from heos_scrobbler.last_fm import LastFmScrobbler, LastFmScrobblerRetryableScrobbleException
+from heos_scrobbler.scrobbling import Scrobble
 from tests.util import integration_test
 
 
-class TestLastFmScrobblerScrobble:
-    @pytest.mark.asyncio
-    async def test_scrobble_calls_scrobble_sync(self, mocker: MockerFixture, last_fm_network: LastFMNetwork) -> None:
+class TestLastFmScrobblerScrobbleMany:
+    def test_scrobble_many_calls_last_fm_network(self, mocker: MockerFixture, last_fm_network: LastFMNetwork) -> None:
         mocker.patch.object(
             LastFmScrobbler,
             "_create_last_fm_network",
             return_value=last_fm_network,
         )
-        scrobble_sync_mock = mocker.patch.object(LastFmScrobbler, "_scrobble_sync", mocker.Mock())
         scrobbler = LastFmScrobbler()
+        scrobble_many_mock = mocker.patch.object(scrobbler.last_fm_network, "scrobble_many", mocker.Mock())
 
         now = datetime.now()
-        await scrobbler.scrobble(artist="Artist", track="Track", scrobbled_at=now, album="Album")
+        scrobbler.scrobble_many(
+            [
+                Scrobble(artist="Artist", track="Track", scrobbled_at=now, album="Album"),
+                Scrobble(artist="Artist", track="Other track", scrobbled_at=now, album=None),
+            ]
+        )
 
-        scrobble_sync_mock.assert_called_once_with(
-            "Artist",
-            "Track",
-            now,
-            "Album",
+        scrobble_many_mock.assert_called_once_with(
+            [
+                {"artist": "Artist", "title": "Track", "timestamp": int(now.timestamp()), "album": "Album"},
+                {"artist": "Artist", "title": "Other track", "timestamp": int(now.timestamp()), "album": None},
+            ]
         )
 
-    @pytest.mark.asyncio
     @pytest.mark.parametrize(
         "exception_from_pylast,exception_raised",
         [
@@ -40,7 +44,7 @@ class TestLastFmScrobblerScrobble:
             (RuntimeError(), RuntimeError),
         ],
     )
-    async def test_scrobble_raises_on_network_error(
+    def test_scrobble_many_raises_on_network_error(
         self,
         mocker: MockerFixture,
         last_fm_network: LastFMNetwork,
@@ -54,48 +58,42 @@ class TestLastFmScrobblerScrobble:
         )
         scrobbler = LastFmScrobbler()
 
-        mocker.patch.object(scrobbler.last_fm_network, "scrobble", side_effect=exception_from_pylast)
+        mocker.patch.object(scrobbler.last_fm_network, "scrobble_many", side_effect=exception_from_pylast)
 
         with pytest.raises(exception_raised):
-            await scrobbler.scrobble(artist="A", track="T", scrobbled_at=datetime.now(), album="Al")
+            scrobbler.scrobble_many([Scrobble(artist="A", track="T", scrobbled_at=datetime.now(), album="Al")])
 
-    @pytest.mark.asyncio
-    @pytest.mark.parametrize(
-        "artist,track,album,expect_exception",
-        [
-            ("Artist", "Track", "Album", None),
-            ("", "Track", "Album", ValidationError),
-            ("Artist", "", "Album", ValidationError),
-        ],
-    )
-    async def test_scrobble_validation(
-        self,
-        mocker: MockerFixture,
-        last_fm_network: LastFMNetwork,
-        artist: str,
-        track: str,
-        album: str,
-        expect_exception: Optional[Type[Exception]],
-    ) -> None:
-        mocker.patch.object(
-            LastFmScrobbler,
-            "_create_last_fm_network",
-            return_value=last_fm_network,
-        )
-        scrobbler = LastFmScrobbler()
 
+class TestLastFmScrobblerHasScrobbled:
+    def test_has_scrobbled_looks_up_recent_tracks(self, mocker: MockerFixture, last_fm_network: LastFMNetwork) -> None:
+        mocker.patch.object(LastFmScrobbler, "_create_last_fm_network", return_value=last_fm_network)
+        scrobbler = LastFmScrobbler()
         now = datetime.now()
+        timestamp = int(now.timestamp())
+        user = mocker.Mock(spec=User)
+        user.get_recent_tracks.return_value = [
+            PlayedTrack(
+                track=Track("Corrected artist", "TRACK", last_fm_network),
+                album=None,
+                playback_date="",
+                timestamp=str(timestamp),
+            )
+        ]
+        mocker.patch.object(scrobbler.last_fm_network, "get_user", return_value=user)
 
-        if expect_exception:
-            with pytest.raises(expect_exception):
-                await scrobbler.scrobble(artist=artist, track=track, scrobbled_at=now, album=album)
-        else:
-            scrobble_mock = mocker.patch.object(scrobbler.last_fm_network, "scrobble", mocker.Mock())
-            await scrobbler.scrobble(artist=artist, track=track, scrobbled_at=now, album=album)
+        assert scrobbler.has_scrobbled(Scrobble(artist="Artist", track="Track", scrobbled_at=now, album=None))
+        assert not scrobbler.has_scrobbled(Scrobble(artist="Artist", track="Other track", scrobbled_at=now, album=None))
+        user.get_recent_tracks.assert_called_with(limit=None, time_from=timestamp - 1, time_to=timestamp + 1)
 
-            scrobble_mock.assert_called_once_with(
-                artist=artist, title=track, timestamp=int(now.timestamp()), album=album
-            )
+    def test_has_scrobbled_raises_retryable_exception_on_network_error(
+        self, mocker: MockerFixture, last_fm_network: LastFMNetwork
+    ) -> None:
+        mocker.patch.object(LastFmScrobbler, "_create_last_fm_network", return_value=last_fm_network)
+        scrobbler = LastFmScrobbler()
+        mocker.patch.object(scrobbler.last_fm_network, "get_user", side_effect=NetworkError("net", None))
+
+        with pytest.raises(LastFmScrobblerRetryableScrobbleException):
+            scrobbler.has_scrobbled(Scrobble(artist="A", track="T", scrobbled_at=datetime.now(), album=None))
 
 
 class TestLastFmScrobblerUpdateNowPlaying:
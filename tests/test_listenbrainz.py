@@ -0,0 +1,194 @@
+import json
+import threading
+import urllib.error
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Iterator, cast
+
+import pytest
+
+from heos_scrobbler.listenbrainz import ListenBrainzScrobbler, ListenBrainzScrobblerRetryableScrobbleException
+from heos_scrobbler.scrobbling import Scrobble
+
+
+class StubListenBrainzServer(ThreadingHTTPServer):
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StubListenBrainzRequestHandler)
+        self.requests: list[tuple[str, str, dict[str, Any]]] = []
+        self.response_status: int = 200
+        self.listens: list[dict[str, Any]] = []
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class StubListenBrainzRequestHandler(BaseHTTPRequestHandler):
+    def do_POST(self) -> None:
+        server = cast(StubListenBrainzServer, self.server)
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        server.requests.append((self.path, self.headers["Authorization"], body))
+
+        self.send_response(server.response_status)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(b'{"status": "ok"}')
+
+    def do_GET(self) -> None:
+        server = cast(StubListenBrainzServer, self.server)
+        server.requests.append((self.path, self.headers["Authorization"], {}))
+
+        if self.path == "/1/validate-token":
+            body: dict[str, Any] = {"valid": True, "user_name": "user name"}
+        else:
+            body = {"payload": {"listens": server.listens}}
+
+        self.send_response(server.response_status)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(json.dumps(body).encode())
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+@pytest.fixture
+def server() -> Iterator[StubListenBrainzServer]:
+    server = StubListenBrainzServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
+
+
+def test_scrobble_many_submits_listens(server: StubListenBrainzServer) -> None:
+    scrobbler = ListenBrainzScrobbler(url=server.url, token="token")
+    now = datetime.now()
+
+    scrobbler.scrobble_many([Scrobble(artist="Artist", track="Track", scrobbled_at=now, album="Album")])
+    scrobbler.scrobble_many(
+        [
+            Scrobble(artist="Artist", track="Track", scrobbled_at=now, album=None),
+            Scrobble(artist="Artist", track="Other track", scrobbled_at=now, album=None),
+        ]
+    )
+
+    assert server.requests == [
+        (
+            "/1/submit-listens",
+            "Token token",
+            {
+                "listen_type": "single",
+                "payload": [
+                    {
+                        "listened_at": int(now.timestamp()),
+                        "track_metadata": {"artist_name": "Artist", "track_name": "Track", "release_name": "Album"},
+                    }
+                ],
+            },
+        ),
+        (
+            "/1/submit-listens",
+            "Token token",
+            {
+                "listen_type": "import",
+                "payload": [
+                    {
+                        "listened_at": int(now.timestamp()),
+                        "track_metadata": {"artist_name": "Artist", "track_name": "Track"},
+                    },
+                    {
+                        "listened_at": int(now.timestamp()),
+                        "track_metadata": {"artist_name": "Artist", "track_name": "Other track"},
+                    },
+                ],
+            },
+        ),
+    ]
+
+
+@pytest.mark.parametrize(
+    "response_status,exception_raised",
+    [
+        (429, ListenBrainzScrobblerRetryableScrobbleException),
+        (503, ListenBrainzScrobblerRetryableScrobbleException),
+        (401, urllib.error.HTTPError),
+    ],
+)
+def test_scrobble_many_raises_on_error_response(
+    server: StubListenBrainzServer, response_status: int, exception_raised: type[Exception]
+) -> None:
+    server.response_status = response_status
+    scrobbler = ListenBrainzScrobbler(url=server.url, token="token")
+
+    with pytest.raises(exception_raised):
+        scrobbler.scrobble_many([Scrobble(artist="A", track="T", scrobbled_at=datetime.now(), album=None)])
+
+
+def test_scrobble_many_raises_retryable_exception_when_server_is_unreachable(server: StubListenBrainzServer) -> None:
+    scrobbler = ListenBrainzScrobbler(url=server.url, token="token")
+    server.shutdown()
+    server.server_close()
+
+    with pytest.raises(ListenBrainzScrobblerRetryableScrobbleException):
+        scrobbler.scrobble_many([Scrobble(artist="A", track="T", scrobbled_at=datetime.now(), album=None)])
+
+
+def test_has_scrobbled_looks_up_listens_of_the_user(server: StubListenBrainzServer) -> None:
+    scrobbler = ListenBrainzScrobbler(url=server.url, token="token")
+    now = datetime.now()
+    listened_at = int(now.timestamp())
+    server.listens = [
+        {"listened_at": listened_at, "track_metadata": {"artist_name": "Artist", "track_name": "TRACK"}},
+        {"listened_at": listened_at - 200, "track_metadata": {"artist_name": "Artist", "track_name": "Other track"}},
+    ]
+
+    assert scrobbler.has_scrobbled(Scrobble(artist="Artist", track="Track", scrobbled_at=now, album=None))
+    assert not scrobbler.has_scrobbled(Scrobble(artist="Artist", track="Other track", scrobbled_at=now, album=None))
+
+    # User name is looked up once
+    assert [path for path, _, _ in server.requests] == [
+        "/1/validate-token",
+        f"/1/user/user%20name/listens?max_ts={listened_at + 1}&count=10",
+        f"/1/user/user%20name/listens?max_ts={listened_at + 1}&count=10",
+    ]
+
+
+def test_has_scrobbled_raises_retryable_exception_on_server_error(server: StubListenBrainzServer) -> None:
+    server.response_status = 503
+    scrobbler = ListenBrainzScrobbler(url=server.url, token="token")
+
+    with pytest.raises(ListenBrainzScrobblerRetryableScrobbleException):
+        scrobbler.has_scrobbled(Scrobble(artist="A", track="T", scrobbled_at=datetime.now(), album=None))
+
+
+def test_update_now_playing(server: StubListenBrainzServer) -> None:
+    scrobbler = ListenBrainzScrobbler(url=server.url, token="token")
+
+    scrobbler.update_now_playing(artist="Artist", track="Track", duration=120, album="Album")
+
+    server.response_status = 503
+    # Should not raise
+    scrobbler.update_now_playing(artist="Artist", track="Track", duration=120, album="Album")
+
+    assert server.requests[0][2] == {
+        "listen_type": "playing_now",
+        "payload": [
+            {
+                "track_metadata": {
+                    "artist_name": "Artist",
+                    "track_name": "Track",
+                    "release_name": "Album",
+                    "additional_info": {"duration_ms": 120_000},
+                }
+            }
+        ],
+    }
+
+
+def test_url_must_be_http() -> None:
+    with pytest.raises(ValueError):
+        ListenBrainzScrobbler(url="file:///etc/passwd", token="token")
@@ -0,0 +1,310 @@
+import asyncio
+import dataclasses
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+import pytest
+from pydantic import ValidationError
+from pytest_mock import MockerFixture
+
+from heos_scrobbler.history import ListeningHistory, ScrobbleStatus
+from heos_scrobbler.idempotency import ScrobbleIndex, create_idempotency_key
+from heos_scrobbler.scrobbling import (
+    Scrobble,
+    ScrobblingBackend,
+    ScrobblingBackendQueue,
+    ScrobblingBackendRetryableException,
+    ScrobblingBackends,
+)
+
+
+class StubScrobblingBackend(ScrobblingBackend):
+    max_batch_size: int = 3
+
+    def __init__(
+        self,
+        failures: int = 0,
+        exception: Optional[Exception] = None,
+        rejected_track: Optional[str] = None,
+        accept_before_failure: bool = False,
+    ):
+        self.failures: int = failures
+        self.exception: Exception = exception or ScrobblingBackendRetryableException()
+        self.rejected_track: Optional[str] = rejected_track
+        # E.g. request timed out after the service accepted the scrobbles
+        self.accept_before_failure: bool = accept_before_failure
+        self.batches: list[list[Scrobble]] = []
+        self.now_playing: list[str] = []
+        self.release: threading.Event = threading.Event()
+        self.release.set()
+
+    def scrobble_many(self, scrobbles: list[Scrobble]) -> None:
+        self.release.wait()
+
+        if self.failures != 0:
+            self.failures -= 1
+
+            if self.accept_before_failure:
+                self.batches.append(scrobbles)
+
+            raise self.exception
+
+        if any(scrobble.track == self.rejected_track for scrobble in scrobbles):
+            raise ValueError(self.rejected_track)
+
+        self.batches.append(scrobbles)
+
+    def update_now_playing(self, artist: str, track: str, duration: int, album: Optional[str]) -> None:
+        self.release.wait()
+        self.now_playing.append(track)
+
+    def has_scrobbled(self, scrobble: Scrobble) -> Optional[bool]:
+        return any(scrobble in batch for batch in self.batches)
+
+
+def _create_queue(
+    backend: ScrobblingBackend,
+    name: str = "stub",
+    min_request_interval: float = 0,
+    scrobble_index: Optional[ScrobbleIndex] = None,
+) -> ScrobblingBackendQueue:
+    return ScrobblingBackendQueue(
+        name=name,
+        backend=backend,
+        batch_size=10,
+        min_request_interval=min_request_interval,
+        retry_scrobble_for_hours=1,
+        scrobble_index=scrobble_index,
+    )
+
+
+def _scrobble(track: str) -> Scrobble:
+    return Scrobble(artist="Artist", track=track, scrobbled_at=datetime.now(), album=None)
+
+
+class TestScrobblingBackendQueue:
+    @pytest.mark.asyncio
+    async def test_scrobbles_queued_during_request_are_batched(self) -> None:
+        backend = StubScrobblingBackend()
+        backend.release.clear()
+        queue = _create_queue(backend)
+        queue.start()
+
+        first = queue.scrobble(_scrobble("0"))
+        await asyncio.sleep(0.01)
+        rest = [queue.scrobble(_scrobble(str(track))) for track in range(1, 6)]
+        backend.release.set()
+
+        await asyncio.gather(first, *rest)
+        await queue.close()
+
+        # Batch size is capped to max_batch_size of the backend
+        assert [[scrobble.track for scrobble in batch] for batch in backend.batches] == [
+            ["0"],
+            ["1", "2", "3"],
+            ["4", "5"],
+        ]
+
+    @pytest.mark.asyncio
+    async def test_retryable_failures_are_retried(self, mocker: MockerFixture) -> None:
+        mocker.patch.object(asyncio, "sleep", mocker.AsyncMock())
+        backend = StubScrobblingBackend(failures=2)
+        queue = _create_queue(backend)
+        queue.start()
+
+        await queue.scrobble(_scrobble("0"))
+        await queue.close()
+
+        assert len(backend.batches) == 1
+
+    @pytest.mark.asyncio
+    async def test_other_failures_are_raised_to_waiters(self) -> None:
+        backend = StubScrobblingBackend(failures=1, exception=ValueError())
+        queue = _create_queue(backend)
+        queue.start()
+
+        with pytest.raises(ValueError):
+            await queue.scrobble(_scrobble("0"))
+
+        # Queue keeps processing after a failed batch
+        await queue.scrobble(_scrobble("1"))
+        await queue.close()
+
+        assert [batch[0].track for batch in backend.batches] == ["1"]
+
+    @pytest.mark.asyncio
+    async def test_rejected_batch_is_submitted_one_by_one(self) -> None:
+        backend = StubScrobblingBackend(rejected_track="2")
+        backend.release.clear()
+        queue = _create_queue(backend)
+        queue.start()
+
+        first = queue.scrobble(_scrobble("0"))
+        await asyncio.sleep(0.01)
+        rest = [queue.scrobble(_scrobble(str(track))) for track in range(1, 4)]
+        backend.release.set()
+
+        results = await asyncio.gather(first, *rest, return_exceptions=True)
+        await queue.close()
+
+        # Only the rejected scrobble fails
+        assert [isinstance(result, ValueError) for result in results] == [False, False, True, False]
+        assert [[scrobble.track for scrobble in batch] for batch in backend.batches] == [["0"], ["1"], ["3"]]
+
+    @pytest.mark.asyncio
+    async def test_close_cancels_queued_scrobbles(self) -> None:
+        backend = StubScrobblingBackend()
+        backend.release.clear()
+        queue = _create_queue(backend)
+        queue.start()
+
+        in_flight = queue.scrobble(_scrobble("0"))
+        await asyncio.sleep(0.01)
+        queued = queue.scrobble(_scrobble("1"))
+
+        close_task = asyncio.create_task(queue.close())
+        await asyncio.sleep(0.01)
+        backend.release.set()
+        await close_task
+
+        assert in_flight.cancelled()
+        assert queued.cancelled()
+
+    @pytest.mark.asyncio
+    async def test_only_latest_now_playing_is_sent(self) -> None:
+        backend = StubScrobblingBackend()
+        backend.release.clear()
+        queue = _create_queue(backend)
+        queue.start()
+
+        queue.update_now_playing(artist="Artist", track="0", duration=120, album=None)
+        await asyncio.sleep(0.01)
+
+        for track in range(1, 4):
+            queue.update_now_playing(artist="Artist", track=str(track), duration=120, album=None)
+
+        backend.release.set()
+        await asyncio.sleep(0.1)
+        await queue.close()
+
+        assert backend.now_playing == ["0", "3"]
+
+    @pytest.mark.asyncio
+    async def test_requests_are_spaced_by_min_request_interval(self, mocker: MockerFixture) -> None:
+        sleep_mock = mocker.patch.object(asyncio, "sleep", mocker.AsyncMock())
+        queue = _create_queue(StubScrobblingBackend(), min_request_interval=60)
+
+        await queue._submit_scrobbles([_scrobble("0")])
+        sleep_mock.assert_not_awaited()
+
+        await queue._submit_scrobbles([_scrobble("1")])
+        sleep_mock.assert_awaited_once_with(pytest.approx(60, abs=1))
+
+    @pytest.mark.asyncio
+    async def test_already_submitted_scrobbles_are_skipped(self, mocker: MockerFixture, tmp_path: Path) -> None:
+        mocker.patch.object(asyncio, "sleep", mocker.AsyncMock())
+        scrobble_index = ScrobbleIndex(path=str(tmp_path / "scrobble_index.bin"), capacity=100)
+        scrobble_index.open()
+        backend = StubScrobblingBackend()
+        queue = _create_queue(backend, scrobble_index=scrobble_index)
+        scrobble = _scrobble("0")
+
+        await queue._submit_scrobbles([scrobble, scrobble, _scrobble("1")])
+        # E.g. retry of a batch of which the first scrobble was already accepted
+        backend.failures = 1
+        await queue._submit_scrobbles_with_retry([dataclasses.replace(scrobble, album="Album"), _scrobble("2")])
+        # Same play on other player is not a duplicate
+        await queue._submit_scrobbles([dataclasses.replace(scrobble, player_id=1)])
+
+        scrobble_index.close()
+
+        assert [[scrobble.track for scrobble in batch] for batch in backend.batches] == [["0", "1"], ["2"], ["0"]]
+        assert len(scrobble_index) == 4
+
+    @pytest.mark.asyncio
+    async def test_scrobbles_accepted_before_failure_are_not_submitted_again(
+        self, mocker: MockerFixture, tmp_path: Path
+    ) -> None:
+        mocker.patch.object(asyncio, "sleep", mocker.AsyncMock())
+        scrobble_index = ScrobbleIndex(path=str(tmp_path / "scrobble_index.bin"), capacity=100)
+        scrobble_index.open()
+        backend = StubScrobblingBackend(failures=1, accept_before_failure=True)
+        queue = _create_queue(backend, scrobble_index=scrobble_index)
+        has_scrobbled_spy = mocker.spy(backend, "has_scrobbled")
+
+        await queue._submit_scrobbles_with_retry([_scrobble("0")])
+        # Service is asked only about scrobbles of which the outcome is unknown
+        await queue._submit_scrobbles([_scrobble("1")])
+
+        scrobble_index.close()
+
+        assert [[scrobble.track for scrobble in batch] for batch in backend.batches] == [["0"], ["1"]]
+        assert has_scrobbled_spy.call_count == 1
+
+    @pytest.mark.asyncio
+    async def test_pending_scrobbles_missing_from_service_are_submitted_again(self, tmp_path: Path) -> None:
+        scrobble_index = ScrobbleIndex(path=str(tmp_path / "scrobble_index.bin"), capacity=100)
+        scrobble_index.open()
+        backend = StubScrobblingBackend()
+        queue = _create_queue(backend, scrobble_index=scrobble_index)
+        scrobble = _scrobble("0")
+        key = create_idempotency_key(
+            backend="stub",
+            player_id=None,
+            artist=scrobble.artist,
+            track=scrobble.track,
+            started_at_timestamp=int(scrobble.scrobbled_at.timestamp()),
+        )
+        # Process crashed before the request reached the service
+        scrobble_index.add_pending(key)
+
+        await queue._submit_scrobbles([scrobble])
+
+        assert scrobble_index.is_acknowledged(key)
+        scrobble_index.close()
+
+        assert [[scrobble.track for scrobble in batch] for batch in backend.batches] == [["0"]]
+
+
+class TestScrobblingBackends:
+    @pytest.mark.asyncio
+    async def test_scrobble_fans_out_to_all_backends(self, mocker: MockerFixture) -> None:
+        backends = [StubScrobblingBackend(), StubScrobblingBackend(failures=1, exception=ValueError())]
+        listening_history = mocker.Mock(spec=ListeningHistory)
+        scrobbling_backends = ScrobblingBackends(
+            queues=[_create_queue(backend, name=str(index)) for index, backend in enumerate(backends)],
+            listening_history=listening_history,
+        )
+        scrobbling_backends.start()
+
+        # Failure of one backend does not prevent scrobbling to the others
+        with pytest.raises(ValueError):
+            await scrobbling_backends.scrobble(
+                artist="Artist", track="Track", scrobbled_at=datetime.now(), album=None, player_name="Kitchen"
+            )
+
+        # Outcome of each backend is recorded
+        assert sorted(
+            (call.args[0].backend, call.args[0].player_name, call.args[0].status)
+            for call in listening_history.record_scrobble.call_args_list
+        ) == [("0", "Kitchen", ScrobbleStatus.SCROBBLED), ("1", "Kitchen", ScrobbleStatus.FAILED)]
+
+        scrobbling_backends.update_now_playing(artist="Artist", track="Track", duration=120, album=None)
+        await asyncio.sleep(0.1)
+        await scrobbling_backends.close()
+
+        assert len(backends[0].batches) == 1
+        assert len(backends[1].batches) == 0
+        assert all(backend.now_playing == ["Track"] for backend in backends)
+
+    @pytest.mark.asyncio
+    async def test_scrobble_validation(self) -> None:
+        scrobbling_backends = ScrobblingBackends(queues=[])
+
+        with pytest.raises(ValidationError):
+            scrobbling_backends.scrobble(artist="", track="Track", scrobbled_at=datetime.now(), album=None)
+
+        with pytest.raises(ValidationError):
+            scrobbling_backends.update_now_playing(artist="Artist", track="", duration=120, album=None)
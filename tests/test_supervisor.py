@@ -0,0 +1,242 @@
+import asyncio
+import multiprocessing
+import queue
+from datetime import datetime
+from multiprocessing.connection import Connection
+from multiprocessing.process import BaseProcess
+from multiprocessing.sharedctypes import Synchronized
+from multiprocessing.synchronize import Event
+from typing import Any
+
+import pytest
+from faker import Faker
+from pydantic import ValidationError
+from pytest_mock import MockerFixture
+
+from config import settings
+from heos_scrobbler.scrobbling import Scrobble, ScrobblingBackends
+from heos_scrobbler.supervisor import (
+    ScrobbleQueue,
+    ScrobbleSubmitterClient,
+    Supervisor,
+    _run_submitter,
+    _run_worker,
+    _submit,
+    assign_heos_devices,
+)
+
+
+@pytest.fixture
+def heos_device_ips(faker: Faker) -> list[str]:
+    return list({faker.ipv4_private() for _ in range(50)})
+
+
+def _forward_scrobbles(
+    in_flight_scrobbles: "Synchronized[int]", scrobble_queue: ScrobbleQueue, received: Connection
+) -> None:
+    # Pipe has no locks which a killed submitter could leave held
+    while (message := scrobble_queue.get()) is not None:
+        received.send(message)
+
+
+def _send_scrobble(
+    heos_device_ips: list[str], shutdown_request: Event, scrobble_queue: ScrobbleQueue, received: Connection
+) -> None:
+    scrobble_queue.put(("scrobble", {"artist": "Artist", "track": "Track", "player_name": heos_device_ips[0]}))
+    shutdown_request.wait()
+
+
+def test_assign_heos_devices_assigns_each_device_once(heos_device_ips: list[str]) -> None:
+    assignments = assign_heos_devices(heos_device_ips, workers=4)
+
+    assert len(assignments) == 4
+    assert sorted(ip for assigned in assignments for ip in assigned) == sorted(heos_device_ips)
+    assert assign_heos_devices(list(reversed(heos_device_ips)), workers=4) == assignments
+
+
+def test_assign_heos_devices_moves_only_changed_devices(heos_device_ips: list[str]) -> None:
+    assignments = assign_heos_devices(heos_device_ips[1:], workers=4)
+    assignments_with_new_device = assign_heos_devices(heos_device_ips, workers=4)
+
+    for worker, assigned in enumerate(assignments_with_new_device):
+        assert [ip for ip in assigned if ip != heos_device_ips[0]] == assignments[worker]
+
+
+class TestSupervisor:
+    @pytest.mark.asyncio
+    async def test_reconcile_starts_restarts_and_rebalances_workers(
+        self, mocker: MockerFixture, heos_device_ips: list[str]
+    ) -> None:
+        supervisor = Supervisor(workers=2)
+        start_process_mock = mocker.patch.object(
+            supervisor, "_start_process", side_effect=lambda *args, **kwargs: mocker.Mock(is_alive=lambda: True)
+        )
+        stop_process_mock = mocker.patch.object(supervisor, "_stop_process", mocker.AsyncMock())
+
+        await supervisor._reconcile(heos_device_ips[1:])
+        assert start_process_mock.call_count == 2
+
+        # Nothing changed
+        await supervisor._reconcile(heos_device_ips[1:])
+        assert start_process_mock.call_count == 2
+
+        # Crashed worker is restarted
+        supervisor._worker_processes[0].is_alive = lambda: False
+        await supervisor._reconcile(heos_device_ips[1:])
+        assert start_process_mock.call_count == 3
+        stop_process_mock.assert_not_awaited()
+
+        # Only the worker getting the new device is restarted
+        await supervisor._reconcile(heos_device_ips)
+        assert start_process_mock.call_count == 4
+        stop_process_mock.assert_awaited_once()
+        assert start_process_mock.call_args.args[1] == next(
+            assigned for assigned in assign_heos_devices(heos_device_ips, workers=2) if heos_device_ips[0] in assigned
+        )
+
+    @pytest.mark.asyncio
+    async def test_stop_process_requests_graceful_shutdown(self, mocker: MockerFixture) -> None:
+        process = mocker.Mock(spec=BaseProcess)
+        process.is_alive.return_value = False
+        shutdown_request = multiprocessing.Event()
+
+        await Supervisor._stop_process(process, shutdown_request)
+
+        assert shutdown_request.is_set()
+        process.join.assert_called_once()
+        process.terminate.assert_not_called()
+        process.kill.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_restarting_submitter_resets_in_flight_scrobbles(self, mocker: MockerFixture) -> None:
+        supervisor = Supervisor(workers=1)
+        start_process_mock = mocker.patch.object(supervisor, "_start_process", mocker.Mock())
+        supervisor._submitter = mocker.Mock(spec=BaseProcess, exitcode=1)
+        supervisor._in_flight_scrobbles.value = 3
+
+        await supervisor._start_submitter()
+
+        assert supervisor._in_flight_scrobbles.value == 0
+        start_process_mock.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_scrobbles_reach_submitter_restarted_after_being_killed(self, mocker: MockerFixture) -> None:
+        supervisor = Supervisor(workers=1)
+        receiver, received = supervisor._context.Pipe(duplex=False)
+        start_process = supervisor._start_process
+        targets = {_run_submitter: _forward_scrobbles, _run_worker: _send_scrobble}
+        mocker.patch.object(
+            supervisor,
+            "_start_process",
+            side_effect=lambda target, *args, name: start_process(targets[target], *args, received, name=name),
+        )
+
+        try:
+            await supervisor._start_submitter()
+            await supervisor._reconcile(["192.168.1.2"])
+            assert await asyncio.to_thread(receiver.poll, 30)
+            assert receiver.recv()[0] == "scrobble"
+
+            # Killed while waiting for the next message, i.e. holding the read lock of its queue
+            await asyncio.sleep(0.5)
+            assert supervisor._submitter is not None
+            supervisor._submitter.kill()
+            await asyncio.to_thread(supervisor._submitter.join)
+
+            await supervisor._start_submitter()
+            await supervisor._reconcile(["192.168.1.2"])
+
+            assert await asyncio.to_thread(receiver.poll, 30)
+            assert receiver.recv()[0] == "scrobble"
+        finally:
+            await supervisor._stop()
+
+
+def test_scrobble_submitter_client_forwards_requests_to_queue() -> None:
+    scrobble_queue: queue.Queue[Any] = queue.Queue()
+    client = ScrobbleSubmitterClient(scrobble_queue)  # pyright: ignore [reportArgumentType]
+    now = datetime.now()
+
+    client.scrobble_many([Scrobble(artist="Artist", track="Track", scrobbled_at=now, album="Album")])
+    client.update_now_playing(artist="Artist", track="Track", duration=120, album="Album")
+
+    assert scrobble_queue.get_nowait() == (
+        "scrobble",
+        {
+            "artist": "Artist",
+            "track": "Track",
+            "scrobbled_at": now,
+            "album": "Album",
+            "player_id": None,
+            "player_name": None,
+        },
+    )
+    assert scrobble_queue.get_nowait() == (
+        "update_now_playing",
+        {"artist": "Artist", "track": "Track", "duration": 120, "album": "Album"},
+    )
+
+
+@pytest.mark.asyncio
+async def test_submit_forwards_messages_to_scrobbling_backends(mocker: MockerFixture) -> None:
+    scrobbling_backends = mocker.Mock(spec=ScrobblingBackends)
+    scrobbled: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+    scrobbled.set_result(None)
+    scrobbling_backends.scrobble.return_value = scrobbled
+    scrobble_queue: queue.Queue[Any] = queue.Queue()
+    in_flight_scrobbles = multiprocessing.Value("i", 0)
+    now = datetime.now()
+
+    scrobble_queue.put(("scrobble", {"artist": "Artist", "track": "Track", "scrobbled_at": now, "album": "Album"}))
+    scrobble_queue.put(("update_now_playing", {"artist": "Artist", "track": "Track", "duration": 120, "album": None}))
+    scrobble_queue.put(None)
+
+    await _submit(scrobble_queue, scrobbling_backends, in_flight_scrobbles)  # pyright: ignore [reportArgumentType]
+
+    scrobbling_backends.start.assert_called_once()
+    scrobbling_backends.scrobble.assert_called_once_with(
+        artist="Artist", track="Track", scrobbled_at=now, album="Album"
+    )
+    scrobbling_backends.update_now_playing.assert_called_once_with(
+        artist="Artist", track="Track", duration=120, album=None
+    )
+    scrobbling_backends.close.assert_awaited_once()
+    assert in_flight_scrobbles.value == 0
+
+
+@pytest.mark.asyncio
+async def test_submit_logs_failed_scrobbles(mocker: MockerFixture, caplog: pytest.LogCaptureFixture) -> None:
+    scrobbling_backends = mocker.Mock(spec=ScrobblingBackends)
+    failed: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+    failed.set_exception(ValueError("Rejected"))
+    scrobbling_backends.scrobble.side_effect = [ValidationError.from_exception_data("Scrobble", []), failed]
+    scrobble_queue: queue.Queue[Any] = queue.Queue()
+    in_flight_scrobbles = multiprocessing.Value("i", 0)
+
+    for track in ("", "Track"):
+        scrobble_queue.put(
+            ("scrobble", {"artist": "Artist", "track": track, "scrobbled_at": datetime.now(), "album": None})
+        )
+    scrobble_queue.put(None)
+
+    await _submit(scrobble_queue, scrobbling_backends, in_flight_scrobbles)  # pyright: ignore [reportArgumentType]
+
+    assert "Failed to scrobble Artist - Track: Rejected" in caplog.text
+    assert in_flight_scrobbles.value == 0
+
+
+@pytest.mark.asyncio
+async def test_submit_waits_for_messages_with_timeout(mocker: MockerFixture) -> None:
+    mocker.patch.object(settings.supervisor, "check_interval_seconds", 0.01)
+    scrobbling_backends = mocker.Mock(spec=ScrobblingBackends)
+    scrobble_queue: queue.Queue[Any] = queue.Queue()
+    get_spy = mocker.spy(scrobble_queue, "get")
+    in_flight_scrobbles = multiprocessing.Value("i", 0)
+
+    asyncio.get_running_loop().call_later(0.1, scrobble_queue.put, None)
+    await _submit(scrobble_queue, scrobbling_backends, in_flight_scrobbles)  # pyright: ignore [reportArgumentType]
+
+    # Thread reading the queue is never blocked for long so that the event loop can always be closed
+    assert get_spy.call_count > 1
+    assert all(call.kwargs["timeout"] == 0.01 for call in get_spy.call_args_list)
+    scrobbling_backends.close.assert_awaited_once()